@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""FaceDetector.run_batch() against processing the images one by one with process().
+
+Both run in a single process with the same detector. Checks that the results
+are identical and reports the time per image. Uses the synthetic dataset unless
+a folder with photos is given.
+
+Usage: benchmarks/bench_batch.py [-i IMGPATH] [-n COUNT] [--prefetch N] [-e MODE]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import synthetic
+from config import Config, EqualizeHistMode
+from facedetector import FaceDetector
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--imgpath', help='Folder with sample images. The synthetic dataset is used if not set.')
+    parser.add_argument('-n', '--count', type=int, default=60, help='Number of images to process.')
+    parser.add_argument('--data', default=os.path.join(ROOT, '.bench-data'), help='Folder of the synthetic dataset.')
+    parser.add_argument('--prefetch', type=int, default=FaceDetector.PREFETCH, help='Images read ahead by run_batch().')
+    parser.add_argument('-e', '--equalizehist', type=EqualizeHistMode, choices=list(EqualizeHistMode), default=EqualizeHistMode.CLAHE, help='Histogram equalization mode.')
+    parser.add_argument('--detect-size', type=int, default=640, help='Longest side of the downscaled image, 0 for full resolution.')
+    args = parser.parse_args()
+
+    if args.imgpath:
+        imgpath = os.path.abspath(args.imgpath)
+    else:
+        _, imgpath = synthetic.generate(os.path.abspath(args.data), args.count, synthetic.parse_sizes(synthetic.SIZES))
+    imgs = sorted(os.path.join(imgpath, fn) for fn in os.listdir(imgpath)
+                  if fn.lower().endswith(Config.imgextensions))[:args.count]
+    if not imgs:
+        print(f"No images found in '{imgpath}'.")
+        sys.exit(1)
+
+    os.chdir(ROOT)
+    Config.crop = True
+    Config.equalizehist = args.equalizehist
+    detector = FaceDetector(Config.cascpath, args.detect_size, Config.scalefactor)
+
+    # Warm up, so both runs start with the same caches
+    detector.process(imgs[0])
+
+    start = time.perf_counter()
+    single = [detector.process(img) for img in imgs]
+    t_single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = [vis for _, _, vis in detector.run_batch(imgs, args.prefetch)]
+    t_batch = time.perf_counter() - start
+
+    same = all(a.shape == b.shape and np.array_equal(a, b) for a, b in zip(single, batch))
+    print(f"{len(imgs)} images, detect size {args.detect_size}, equalization {args.equalizehist}")
+    print(f"process() one by one: {t_single:8.3f} s {t_single / len(imgs) * 1000:8.1f} ms/image")
+    print(f"run_batch():          {t_batch:8.3f} s {t_batch / len(imgs) * 1000:8.1f} ms/image")
+    print(f"speedup {t_single / t_batch if t_batch else float('inf'):.2f}x, results identical: {same}")
+
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Per-image cost of loading the Haar cascade for each photo vs. once per process.
+
+Usage: benchmarks/bench_cascade.py [-i IMGPATH] [-n COUNT]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import cv2 as cv
+
+from config import Config
+from facedetector import FaceDetector
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--imgpath', default=Config.imgpath, help='Folder with sample images.')
+    parser.add_argument('-n', '--count', type=int, default=20, help='Number of images to process.')
+    parser.add_argument('--cascade', default=Config.cascpath, help='Cascade file.')
+    args = parser.parse_args()
+
+    imgs = sorted(os.path.join(args.imgpath, fn) for fn in os.listdir(args.imgpath)
+                  if fn.lower().endswith(Config.imgextensions))[:args.count]
+    if not imgs:
+        print(f"No images found in '{args.imgpath}'.")
+        sys.exit(1)
+
+    # Cascade loading alone
+    start = time.perf_counter()
+    for _ in imgs:
+        cv.CascadeClassifier(args.cascade)
+    load = (time.perf_counter() - start) / len(imgs)
+
+    # Detector loaded for every image (previous behaviour)
+    start = time.perf_counter()
+    for img in imgs:
+        FaceDetector(args.cascade).process(img)
+    per_image = (time.perf_counter() - start) / len(imgs)
+
+    # Detector loaded once
+    start = time.perf_counter()
+    detector = FaceDetector(args.cascade)
+    for img in imgs:
+        detector.process(img)
+    once = (time.perf_counter() - start) / len(imgs)
+
+    print(f"images:                 {len(imgs)}")
+    print(f"cascade load:           {load * 1000:8.2f} ms")
+    print(f"load per image:         {per_image * 1000:8.2f} ms/image")
+    print(f"load once:              {once * 1000:8.2f} ms/image")
+    print(f"saving:                 {(per_image - once) * 1000:8.2f} ms/image")
+
+
+if __name__ == "__main__":
+    main()
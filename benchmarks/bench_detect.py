@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Face detection on full resolution vs. on a downscaled image.
+
+Compares wall time and the final crop boxes (as IoU against the full resolution
+result) for every image in the sample folder.
+
+Usage: benchmarks/bench_detect.py [-i IMGPATH] [--detect-size N] [--scale-factor F]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import cv2 as cv
+
+from config import Config
+from facedetector import FaceDetector
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 0.0
+
+
+def timed_detect(detector, gray):
+    start = time.perf_counter()
+    rects = detector.detect(gray)
+    return rects, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--imgpath', default=Config.imgpath, help='Folder with sample images.')
+    parser.add_argument('-n', '--count', type=int, default=20, help='Number of images to process.')
+    parser.add_argument('--cascade', default=Config.cascpath, help='Cascade file.')
+    parser.add_argument('--detect-size', type=int, default=640, help='Longest side of the downscaled image.')
+    parser.add_argument('--scale-factor', type=float, default=Config.scalefactor, help='Scale factor of the downscaled detection.')
+    args = parser.parse_args()
+
+    imgs = sorted(os.path.join(args.imgpath, fn) for fn in os.listdir(args.imgpath)
+                  if fn.lower().endswith(Config.imgextensions))[:args.count]
+    if not imgs:
+        print(f"No images found in '{args.imgpath}'.")
+        sys.exit(1)
+
+    full = FaceDetector(args.cascade)
+    small = FaceDetector(args.cascade, args.detect_size, args.scale_factor)
+
+    total_full = total_small = 0.0
+    print(f"{'image':40} {'size':>11} {'full [s]':>9} {'small [s]':>9} {'faces':>7} {'IoU':>6}")
+    for imgpath in imgs:
+        img = cv.imread(imgpath)
+        gray = cv.equalizeHist(cv.cvtColor(img, cv.COLOR_BGR2GRAY))
+
+        rects_full, t_full = timed_detect(full, gray)
+        rects_small, t_small = timed_detect(small, gray)
+        total_full += t_full
+        total_small += t_small
+
+        if len(rects_full) and len(rects_small):
+            overlap = f"{iou(rects_full[0], rects_small[0]):6.2f}"
+        else:
+            overlap = f"{'-':>6}"
+
+        h, w = gray.shape
+        print(f"{os.path.basename(imgpath)[:40]:40} {w:>5}x{h:<5} {t_full:9.3f} {t_small:9.3f} "
+              f"{len(rects_full):>3}/{len(rects_small):<3} {overlap}")
+
+    print(f"\ntotal: full {total_full:.3f} s, downscaled {total_small:.3f} s, "
+          f"speedup {total_full / total_small if total_small else float('inf'):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Speed and accuracy of the face detector backends (--detector haar, lbp, dnn).
+
+On the synthetic dataset (default), the found faces are compared with the drawn
+ones: a photo is a hit when the first found face overlaps the drawn one with IoU
+of at least --min-iou. On real photos (-i), there is no ground truth, so the
+backends are compared with the Haar cascade instead.
+
+Backends whose model files are missing are skipped, nothing is downloaded.
+
+Usage: benchmarks/bench_detectors.py [-i IMGPATH] [-n COUNT] [--lbp-model FILE] [--dnn-model FILE] [--detect-size N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+import cv2 as cv
+
+import synthetic
+from bench_detect import iou
+from config import Config, DetectorType
+from facedetector import FaceDetector
+
+
+def detect(detector, img):
+    """Faces [[x1, y1, x2, y2]] not expanded to the head, the input prepared the same way as in find_face()"""
+    if detector.backend.color:
+        return detector.detect(img, expand=False)
+    gray = cv.equalizeHist(cv.cvtColor(img, cv.COLOR_BGR2GRAY))
+    return detector.detect(gray, expand=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--imgpath', help='Folder with real sample images. The synthetic dataset is used if not set.')
+    parser.add_argument('-n', '--count', type=int, default=60, help='Number of images to process.')
+    parser.add_argument('--data', default=os.path.join(ROOT, '.bench-data'), help='Folder of the synthetic dataset.')
+    parser.add_argument('--haar-model', default=Config.DETECTOR_MODELS[DetectorType.HAAR], help='Haar cascade file.')
+    parser.add_argument('--lbp-model', default=Config.DETECTOR_MODELS[DetectorType.LBP], help='LBP cascade file.')
+    parser.add_argument('--dnn-model', default=Config.DETECTOR_MODELS[DetectorType.DNN], help='Caffe model of the DNN detector, deploy.prototxt has to be next to it.')
+    parser.add_argument('--detect-size', type=int, default=Config.detectsize, help='Longest side of the downscaled image, 0 for full resolution.')
+    parser.add_argument('--scale-factor', type=float, default=Config.scalefactor, help='Scale factor of the cascades.')
+    parser.add_argument('--min-iou', type=float, default=0.3, help='Minimal IoU of a found and a drawn face to count as a hit.')
+    args = parser.parse_args()
+    args.data = os.path.abspath(args.data)
+
+    if args.imgpath:
+        args.imgpath = os.path.abspath(args.imgpath)
+        imgs = sorted(os.path.join(args.imgpath, fn) for fn in os.listdir(args.imgpath)
+                      if fn.lower().endswith(Config.imgextensions))[:args.count]
+        truth = None
+    else:
+        _, imgpath = synthetic.generate(args.data, args.count, synthetic.parse_sizes(synthetic.SIZES))
+        with open(os.path.join(args.data, 'faces.json'), encoding='utf-8') as f:
+            faces = json.load(f)
+        imgs = sorted(os.path.join(imgpath, fn) for fn in faces)[:args.count]
+        truth = {img: faces[os.path.basename(img)] for img in imgs}
+
+    if not imgs:
+        print(f"No images found in '{args.imgpath}'.")
+        sys.exit(1)
+
+    # Relative default model paths are relative to the repository
+    os.chdir(ROOT)
+    models = {DetectorType.HAAR: args.haar_model, DetectorType.LBP: args.lbp_model, DetectorType.DNN: args.dnn_model}
+    detectors = {}
+    for detector, model in models.items():
+        try:
+            detectors[detector] = FaceDetector(model, args.detect_size, args.scale_factor, detector)
+        except (OSError, ValueError, cv.error) as e:
+            print(f"{detector}: skipped, {e}")
+
+    # Decoded once, only the detection is timed
+    decoded = [(img, cv.imread(img)) for img in imgs]
+
+    results = {}
+    for detector, fd in detectors.items():
+        elapsed = 0.0
+        found = []
+        for img, data in decoded:
+            start = time.perf_counter()
+            rects = detect(fd, data)
+            elapsed += time.perf_counter() - start
+            found.append([list(r) for r in rects])
+        results[detector] = (elapsed, found)
+
+    if truth:
+        reference, against = truth, 'drawn faces'
+    elif DetectorType.HAAR in results:
+        reference = {img: rects[0] if rects else None for img, rects in zip(imgs, results[DetectorType.HAAR][1])}
+        against = 'haar'
+    else:
+        reference, against = None, 'nothing'
+
+    print(f"\n{len(imgs)} images, hits against {against} with IoU >= {args.min_iou}")
+    print(f"{'detector':9} {'total [s]':>10} {'per image [ms]':>15} {'none':>5} {'one':>5} {'many':>5} {'hits':>6} {'mean IoU':>9}")
+    for detector, (elapsed, found) in results.items():
+        counts = [sum(1 for r in found if len(r) == n) for n in (0, 1)]
+        many = len(found) - sum(counts)
+
+        hits, overlaps = 0, []
+        if reference:
+            for img, rects in zip(imgs, found):
+                box = reference[img]
+                if box is None or not rects:
+                    continue
+                overlap = iou(rects[0], box)
+                if overlap >= args.min_iou:
+                    hits += 1
+                    overlaps.append(overlap)
+
+        hitrate = f"{hits / len(imgs):6.0%}" if reference else f"{'-':>6}"
+        mean = f"{sum(overlaps) / len(overlaps):9.2f}" if overlaps else f"{'-':>9}"
+        print(f"{str(detector):9} {elapsed:10.3f} {elapsed / len(imgs) * 1000:15.1f} "
+              f"{counts[0]:5} {counts[1]:5} {many:5} {hitrate} {mean}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""FaceDetector.hist_eq_other against the original per-channel implementation.
+
+Checks that both give pixel-identical images and times them. Sample photos are
+used when the folder exists, synthetic images (including single-valued and
+narrow-range channels) always. Exits with 1 if any image differs.
+
+Usage: benchmarks/bench_hist_eq.py [-i IMGPATH] [-n COUNT] [-r REPEAT]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'tests'))
+
+import cv2 as cv
+import numpy as np
+
+from config import Config
+from facedetector import FaceDetector
+from hist_eq_reference import hist_eq_reference
+
+
+def synthetic(seed):
+    rng = np.random.default_rng(seed)
+    imgs = {
+        'random 2000x3000': rng.integers(0, 256, (3000, 2000, 3), dtype=np.uint8),
+        'dark 1200x1600': rng.integers(10, 60, (1600, 1200, 3), dtype=np.uint8),
+        'gradient 1024x1024': np.dstack([np.tile(np.arange(1024, dtype=np.uint16) // 4, (1024, 1)).astype(np.uint8)] * 3),
+    }
+    single = rng.integers(0, 256, (600, 800, 3), dtype=np.uint8)
+    single[:, :, 1] = 128
+    imgs['single-valued G 800x600'] = single
+    return imgs
+
+
+def timed(f, img, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = f(img)
+        best = min(best, time.perf_counter() - start)
+    return out, best
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--imgpath', default=Config.imgpath, help='Folder with sample images.')
+    parser.add_argument('-n', '--count', type=int, default=10, help='Number of sample images to process.')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per image, the best time is reported.')
+    args = parser.parse_args()
+
+    imgs = synthetic(0)
+    if os.path.isdir(args.imgpath):
+        paths = sorted(os.path.join(args.imgpath, fn) for fn in os.listdir(args.imgpath)
+                       if fn.lower().endswith(Config.imgextensions))[:args.count]
+        for imgpath in paths:
+            img = cv.imread(imgpath)
+            if img is not None:
+                imgs[os.path.basename(imgpath)] = img
+
+    total_ref = total_new = 0.0
+    differ = 0
+    print(f"{'image':40} {'reference [ms]':>15} {'vectorized [ms]':>16} same")
+    for name, img in imgs.items():
+        ref, t_ref = timed(hist_eq_reference, img, args.repeat)
+        new, t_new = timed(FaceDetector.hist_eq_other, img, args.repeat)
+        total_ref += t_ref
+        total_new += t_new
+
+        same = ref.shape == new.shape and np.array_equal(ref, new)
+        differ += not same
+        print(f"{name[:40]:40} {t_ref * 1000:15.1f} {t_new * 1000:16.1f} {same}")
+
+    print(f"\ntotal: reference {total_ref:.3f} s, vectorized {total_new:.3f} s, "
+          f"speedup {total_ref / total_new if total_new else float('inf'):.1f}x")
+
+    if differ:
+        print(f"{differ} image(s) differ!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Stage by stage timing of the whole generate.py pipeline on a synthetic dataset.
+
+The stages (CSV ingest, photo lookup, image decoding, face detection, crop and
+histogram equalization, encoding, PDF embedding and output) are run one after
+another in this process, the same way generate.do() chains them. Then generate.py
+itself is run on the dataset for the end-to-end time and peak memory.
+
+The results are written to a JSON report. Reports of two commits can be compared
+with --compare.
+
+Usage: benchmarks/bench_pipeline.py [-n COUNT] [--sizes WxH,...] [-e MODE] [-j JOBS] [-r REPORT] [--compare OLD_REPORT]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+import cv2 as cv
+
+import synthetic
+from config import Config, EqualizeHistMode, PrintMode
+from facedetector import FaceDetector
+from layout import LayoutEngine
+from pdfprinter import PDFPrinter, DelimiterStyle
+from people import load_people
+from photoindex import PhotoIndex
+
+STAGES = ('ingest', 'lookup', 'imread', 'detect', 'equalize', 'encode', 'embed', 'output')
+
+EQUALIZE = {
+    EqualizeHistMode.CLAHE: FaceDetector.hist_eq_clahe,
+    EqualizeHistMode.HEQ_YUV: FaceDetector.hist_eq_heq_yuv,
+    EqualizeHistMode.HEQ_HSV: FaceDetector.hist_eq_heq_hsv,
+    EqualizeHistMode.OTHER: FaceDetector.hist_eq_other,
+}
+
+
+def peak_rss(who = resource.RUSAGE_SELF):
+    """Peak resident set size in MiB (ru_maxrss is in KiB on Linux)"""
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Timer:
+    def __init__(self):
+        self.times = defaultdict(float)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+
+
+def run_stages(args, csvpath, imgpath, outpath):
+    """Run the pipeline stage by stage, returns (stage times, face counts)"""
+    timer = Timer()
+    faces = Counter()
+    detector = FaceDetector(Config.cascpath)
+
+    with timer.stage('ingest'):
+        people = load_people(csvpath)
+
+    with timer.stage('lookup'):
+        index = PhotoIndex.build(imgpath, Config.imgextensions)
+        found = [index.lookup(pi.name) for pi in people]
+    paths = [os.path.join(imgpath, fn[0]) if fn else None for fn in found]
+
+    layout = LayoutEngine(PrintMode.ALL, Config.direction)
+    slots = layout.slots(len(people))
+    pp = PDFPrinter(outpath, layout.spacing)
+    page = 0
+
+    for pi, path, slot in zip(people, paths, slots):
+        photo = None
+        if path is not None:
+            with timer.stage('imread'):
+                img = cv.imread(path)
+
+            with timer.stage('detect'):
+                rects = detector.find_face(img)
+            faces['none' if rects is None else 'found'] += 1
+
+            with timer.stage('equalize'):
+                if rects is not None:
+                    img = FaceDetector.crop(img, rects[0,0], rects[0,1], rects[0,2], rects[0,3])
+                img = EQUALIZE[args.equalizehist](img)
+
+            with timer.stage('encode'):
+                photo = PDFPrinter.encode(PDFPrinter.fit_dpi(img, Config.dpi), Config.jpegquality)
+
+        # Same as generate.print_card in the 'all' mode
+        with timer.stage('embed'):
+            if slot.page != page:
+                page = slot.page
+                pp.add_page()
+            if photo is not None:
+                pp.set_coordintates(slot.x, slot.y)
+                pp.print_photo(photo, pi)
+            pp.set_coordintates(slot.xText, slot.yText)
+            pp.print_person_info(pi)
+            pp.print_delimiter(slot.xDelim, slot.yDelim, DelimiterStyle.FRAME)
+
+    with timer.stage('output'):
+        pp.output()
+
+    return timer.times, faces
+
+
+def run_generate(args, csvpath, imgpath, outpath):
+    """Run generate.py on the dataset, returns (wall time, peak RSS of the process in MiB)"""
+    cmd = [sys.executable, os.path.join(ROOT, 'generate.py'), '-i', imgpath, '-p', csvpath, '-o', outpath,
+           '--mode', 'all', '--crop', '-e', str(args.equalizehist), '--jobs', str(args.jobs), '--no-cache']
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start, peak_rss(resource.RUSAGE_CHILDREN)
+
+
+def compare(report, old):
+    print(f"\n{'stage':10} {old['commit'] or 'old':>12} {report['commit'] or 'new':>12} {'ratio':>7}")
+    rows = [(stage, old['stages'].get(stage), report['stages'].get(stage)) for stage in STAGES]
+    rows.append(('total', old['total'], report['total']))
+    if 'end_to_end' in old and 'end_to_end' in report:
+        rows.append(('generate', old['end_to_end']['time'], report['end_to_end']['time']))
+    for name, t_old, t_new in rows:
+        if t_old is None or t_new is None:
+            continue
+        print(f"{name:10} {t_old:11.3f}s {t_new:11.3f}s {t_new / t_old if t_old else float('inf'):7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, default=100, help='Number of synthetic students.')
+    parser.add_argument('--sizes', type=synthetic.parse_sizes, default=synthetic.SIZES, help='Photo resolutions WxH, used in turn.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic dataset.')
+    parser.add_argument('--data', default=os.path.join(ROOT, '.bench-data'), help='Folder of the synthetic dataset, reused between runs.')
+    parser.add_argument('-e', '--equalizehist', type=EqualizeHistMode, choices=list(EqualizeHistMode), default=EqualizeHistMode.CLAHE, help='Histogram equalization mode.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Jobs of the end-to-end generate.py run.')
+    parser.add_argument('--no-generate', help='Skip the end-to-end generate.py run.', action='store_true')
+    parser.add_argument('-r', '--report', default='bench-report.json', help='JSON report to write.')
+    parser.add_argument('--compare', help='JSON report of an earlier run to compare with.')
+    args = parser.parse_args()
+
+    # Relative paths of the configuration (cascade, fonts) are relative to the repository
+    args.data, args.report = os.path.abspath(args.data), os.path.abspath(args.report)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+    os.chdir(ROOT)
+
+    start = time.perf_counter()
+    csvpath, imgpath = synthetic.generate(args.data, args.count, args.sizes, args.seed)
+    print(f"Dataset of {args.count} students ready in {time.perf_counter() - start:.1f} s.")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outpath = os.path.join(tmpdir, 'stages.pdf')
+        times, faces = run_stages(args, csvpath, imgpath, outpath)
+
+        report = {
+            'commit': git_commit(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'opencv': cv.__version__,
+            'machine': platform.machine(),
+            'dataset': {'count': args.count, 'sizes': [f"{w}x{h}" for w, h in args.sizes], 'seed': args.seed},
+            'settings': {'equalizehist': str(args.equalizehist), 'dpi': Config.dpi, 'jpegquality': Config.jpegquality},
+            'stages': {stage: round(times[stage], 4) for stage in STAGES},
+            'total': round(sum(times.values()), 4),
+            'faces': {'found': faces['found'], 'none': faces['none']},
+            'peak_rss_mib': round(peak_rss(), 1),
+            'output_bytes': os.path.getsize(outpath),
+        }
+
+        if not args.no_generate:
+            outpath = os.path.join(tmpdir, 'generate.pdf')
+            elapsed, rss = run_generate(args, csvpath, imgpath, outpath)
+            report['end_to_end'] = {'time': round(elapsed, 3), 'jobs': args.jobs, 'peak_rss_mib': round(rss, 1),
+                                    'output_bytes': os.path.getsize(outpath)}
+
+    print(f"\n{'stage':10} {'time [s]':>9} {'per photo [ms]':>15}")
+    for stage in STAGES:
+        print(f"{stage:10} {times[stage]:9.3f} {times[stage] / args.count * 1000:15.1f}")
+    print(f"{'total':10} {report['total']:9.3f}")
+    print(f"\nface found in {faces['found']} photos, in {faces['none']} not")
+    print(f"peak RSS {report['peak_rss_mib']:.1f} MiB, output {report['output_bytes'] / 2**20:.1f} MiB")
+    if 'end_to_end' in report:
+        e2e = report['end_to_end']
+        print(f"generate.py: {e2e['time']:.3f} s with {e2e['jobs']} job(s), peak RSS {e2e['peak_rss_mib']:.1f} MiB, "
+              f"output {e2e['output_bytes'] / 2**20:.1f} MiB")
+
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to '{args.report}'.")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
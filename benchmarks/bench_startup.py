@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Import time of generate.py for text-only runs vs. runs processing photos.
+
+Measured with `python -X importtime`, reports the cumulative import time and
+which of the heavy modules (OpenCV, NumPy, matplotlib) got loaded.
+
+Usage: benchmarks/bench_startup.py [-n REPEAT]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+HEAVY = ('cv2', 'numpy', 'matplotlib')
+
+SCENARIOS = {
+    'text': 'import generate',
+    'crop': 'import generate, facedetector',
+    'interactive': 'import generate, facedetector, matplotlib.pyplot',
+}
+
+
+def importtime(code):
+    """Return total import time in ms and names of all imported modules"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    total = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        # Nested imports are indented, count the top level ones only
+        if not name.startswith('  '):
+            total += int(cumulative) / 1000
+    return total, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='Number of runs of each scenario, the best one is reported.')
+    args = parser.parse_args()
+
+    print(f"{'scenario':12} {'import [ms]':>12}  heavy modules loaded")
+    for scenario, code in SCENARIOS.items():
+        try:
+            runs = [importtime(code) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{scenario:12} {'-':>12}  {e}")
+            continue
+
+        total, modules = min(runs, key=lambda r: r[0])
+        heavy = [name for name in HEAVY if any(m == name or m.startswith(name + '.') for m in modules)]
+        print(f"{scenario:12} {total:12.1f}  {', '.join(heavy) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
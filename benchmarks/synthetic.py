@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Synthetic dataset for benchmarks, so no real student data is needed.
+
+Writes `students.csv` in the format exported by download_images.py and a folder
+of face-like photos (drawn head, eyes, mouth, hair and shoulders on a noisy
+background) named after the students, in a range of resolutions. Boxes of the drawn
+faces are written to `faces.json` as the ground truth for detector benchmarks.
+The dataset is reproducible, it depends only on the parameters and the seed.
+
+Usage: benchmarks/synthetic.py OUTDIR [-n COUNT] [--sizes WxH,...] [--seed SEED]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import cv2 as cv
+import numpy as np
+
+from people import PersonInfo
+
+SIZES = '480x640,1200x1600,3000x4000'
+VERSION = 2
+
+SYLLABLES = ('an', 'ma', 'ri', 'jo', 'el', 'ka', 'lu', 'no', 'sé', 'to', 'vi', 'ra', 'ol', 'mi', 'ša', 'ck', 'be', 'ün')
+COUNTRIES = ('Austria', 'Brazil', 'Czech Republic', 'France', 'Germany', 'India', 'Italy', 'Japan',
+             'Mexico', 'Poland', 'Portugal', 'Slovakia', 'Spain', 'Turkey', 'Ukraine')
+
+# BGR colors
+SKIN = ((189, 224, 255), (148, 192, 234), (105, 150, 198), (66, 105, 141), (45, 67, 96))
+HAIR = ((20, 20, 20), (30, 50, 90), (80, 140, 200), (60, 60, 60), (120, 120, 140))
+
+
+def parse_sizes(value):
+    try:
+        return [tuple(int(v) for v in size.lower().split('x')) for size in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid sizes '{value}', use e.g. {SIZES}")
+
+
+def names(rng, count):
+    """Unique 'Name Surname' pairs, with diacritics to exercise the photo lookup"""
+    found = {}
+    while len(found) < count:
+        parts = [''.join(rng.choice(SYLLABLES, rng.integers(2, 4))).capitalize() for _ in range(2)]
+        name = ' '.join(parts)
+        found.setdefault(name.casefold(), name)
+    return list(found.values())
+
+
+def face_image(rng, w, h):
+    """Portrait photo with a drawn face in the upper middle part, returns (image, face box [x1, y1, x2, y2])"""
+    # Background gradient with noise
+    top, bottom = rng.integers(60, 230, 3), rng.integers(30, 200, 3)
+    t = np.linspace(0, 1, h)[:, None, None]
+    gradient = (top * (1 - t) + bottom * t).astype(np.int16)
+    img = np.clip(gradient + rng.integers(-10, 11, (h, w, 3), dtype=np.int16), 0, 255).astype(np.uint8)
+
+    s = min(w, h)
+    cx = int(w / 2 + rng.uniform(-0.08, 0.08) * w)
+    cy = int(h * rng.uniform(0.38, 0.48))
+    fw = int(s * rng.uniform(0.18, 0.26))
+    fh = int(fw * 1.3)
+    skin = tuple(int(c) for c in SKIN[rng.integers(len(SKIN))])
+    hair = tuple(int(c) for c in HAIR[rng.integers(len(HAIR))])
+    clothes = tuple(int(c) for c in rng.integers(0, 255, 3))
+    lw = max(s // 200, 1)
+
+    # Shoulders, neck, hair and head
+    cv.ellipse(img, (cx, h), (int(fw * 2.6), int(h - cy - fh * 0.9)), 0, 180, 360, clothes, -1, cv.LINE_AA)
+    cv.rectangle(img, (cx - fw // 2, cy), (cx + fw // 2, cy + int(fh * 1.35)), skin, -1)
+    cv.ellipse(img, (cx, cy - fh // 8), (int(fw * 1.12), int(fh * 1.08)), 0, 0, 360, hair, -1, cv.LINE_AA)
+    cv.ellipse(img, (cx, cy + fh // 10), (fw, fh), 0, 0, 360, skin, -1, cv.LINE_AA)
+
+    # Eyes with eyebrows, nose and mouth
+    ey = cy - fh // 8
+    for ex in (cx - int(fw * 0.42), cx + int(fw * 0.42)):
+        cv.ellipse(img, (ex, ey), (fw // 5, fw // 10), 0, 0, 360, (245, 245, 245), -1, cv.LINE_AA)
+        cv.circle(img, (ex, ey), fw // 12, (40, 30, 20), -1, cv.LINE_AA)
+        cv.ellipse(img, (ex, ey - fw // 5), (fw // 4, fw // 12), 0, 200, 340, hair, lw * 3, cv.LINE_AA)
+    shade = tuple(int(c * 0.75) for c in skin)
+    cv.line(img, (cx, ey + fw // 8), (cx - fw // 10, cy + fh // 4), shade, lw * 2, cv.LINE_AA)
+    cv.ellipse(img, (cx, cy + int(fh * 0.5)), (fw // 3, fh // 10), 0, 10, 170, (60, 60, 160), lw * 3, cv.LINE_AA)
+
+    # Soften the drawing a bit, as a camera would
+    box = [cx - fw, cy + fh // 10 - fh, cx + fw, cy + fh // 10 + fh]
+    return cv.GaussianBlur(img, (0, 0), max(s / 800, 0.5)), box
+
+
+def csv_row(name, country, birthday, validity, before_arrival):
+    """Row as written by download_images.py"""
+    return (f'"{name}","{country}",'
+            f'{",".join(birthday)},'
+            f'{",".join(validity)},'
+            f'{before_arrival}\n')
+
+
+def generate(outdir, count, sizes, seed = 0):
+    """Write the dataset into outdir (students.csv, pictures/, faces.json), reused if already generated with the same parameters.
+
+    Returns paths of the CSV file and of the photo folder. Raises FileExistsError if outdir
+    is not empty and does not hold a dataset of this generator, real data are never overwritten.
+    """
+    csvpath = os.path.join(outdir, 'students.csv')
+    imgpath = os.path.join(outdir, 'pictures')
+    params = {'version': VERSION, 'count': count, 'sizes': [list(size) for size in sizes], 'seed': seed}
+    paramspath = os.path.join(outdir, 'dataset.json')
+
+    try:
+        with open(paramspath, encoding='utf-8') as f:
+            if json.load(f) == params:
+                return csvpath, imgpath
+    except (OSError, ValueError):
+        pass
+
+    if os.path.isdir(outdir) and os.listdir(outdir) and not os.path.isfile(paramspath):
+        raise FileExistsError(f"'{outdir}' is not empty and holds no synthetic dataset (dataset.json), refusing to overwrite it!")
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(imgpath, exist_ok=True)
+    for fn in os.listdir(imgpath):
+        os.remove(os.path.join(imgpath, fn))
+
+    faces = {}
+    with open(csvpath, 'w', encoding='utf-8') as f:
+        f.write(','.join(PersonInfo.COLUMNS) + '\n')
+        for i, name in enumerate(names(rng, count)):
+            birthday = f"{rng.integers(1, 29):02}{rng.integers(1, 13):02}{rng.integers(95, 106) % 100:02}"
+            f.write(csv_row(name, COUNTRIES[rng.integers(len(COUNTRIES))], birthday, '010926',
+                            'yes' if rng.random() < 0.5 else 'no'))
+
+            w, h = sizes[i % len(sizes)]
+            img, faces[name + '.jpg'] = face_image(rng, w, h)
+            cv.imwrite(os.path.join(imgpath, name + '.jpg'), img, [cv.IMWRITE_JPEG_QUALITY, 92])
+
+    with open(os.path.join(outdir, 'faces.json'), 'w', encoding='utf-8') as f:
+        json.dump(faces, f)
+    with open(paramspath, 'w', encoding='utf-8') as f:
+        json.dump(params, f)
+
+    return csvpath, imgpath
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('outdir', help='Folder to write students.csv and pictures/ to.')
+    parser.add_argument('-n', '--count', type=int, default=200, help='Number of students.')
+    parser.add_argument('--sizes', type=parse_sizes, default=SIZES, help='Photo resolutions WxH, used in turn.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+    args = parser.parse_args()
+
+    try:
+        csvpath, imgpath = generate(args.outdir, args.count, args.sizes, args.seed)
+    except FileExistsError as e:
+        print(e)
+        sys.exit(1)
+    print(f"Dataset of {args.count} students written to '{csvpath}' and '{imgpath}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import os
 from enum import Enum
 
 class PrintMode(Enum):
@@ -15,6 +16,13 @@ class PrintDirection(Enum):
     def __str__(self):
         return self.value
 
+class FillOrder(Enum):
+    ROWS = 'rows'         # Cards fill a row first, then continue in the next row
+    COLUMNS = 'columns'   # Cards fill a column first, then continue in the next column
+
+    def __str__(self):
+        return self.value
+
 class EqualizeHistMode(Enum):
     CLAHE = 'clahe'       # Contrast Limited Adaptive Histogram Equalization
     HEQ_YUV = 'heq_yuv'   # Global Histogram Qqualization - convertion from BRG to YUV
@@ -24,6 +32,14 @@ class EqualizeHistMode(Enum):
     def __str__(self):
         return self.value
 
+class DetectorType(Enum):
+    HAAR = 'haar'   # Haar cascade, slow and conservative
+    LBP = 'lbp'     # LBP cascade, faster and less precise
+    DNN = 'dnn'     # ResNet-10 SSD of OpenCV DNN module, finds also rotated and backlit faces
+
+    def __str__(self):
+        return self.value
+
 
 class A4Size:
     """A4 paper size"""
@@ -40,6 +56,15 @@ class TextSize:
     w = 46
     h = 25
 
+class DetectorSettings:
+    """Fixed settings of the face detectors, kept here so the photo cache fingerprint does not need OpenCV"""
+    minFaceSize = 100       # Minimal face size in pixels of the full resolution image
+    minNeighbors = {        # Neighbors needed to accept a face found by a cascade
+        DetectorType.HAAR: 50,
+        DetectorType.LBP: 10,
+    }
+    dnnConfidence = 0.5     # Minimal confidence of a face found by the DNN detector
+
 
 class CardSpacing:
     """Space between initial coordinations (0,0) of objects of the card (i.e. photo, text, etc)"""
@@ -119,10 +144,39 @@ class Config:
     peoplecsv = "students.csv"
     output = "output-<mode>.pdf"
     mode = PrintMode.ALL
+    modes = [PrintMode.ALL]
     direction = PrintDirection.NORMAL
+    fill = FillOrder.ROWS
     crop = False
     equalizehist = None
     interactive = False
+    prefetch = 4
+    indexcache = None
+    jobs = 1
+    cascpath = "haarcascade_frontalface_default.xml"
+    detector = DetectorType.HAAR
+    detectormodel = cascpath
+    # Default model files of the detectors
+    DETECTOR_MODELS = {
+        DetectorType.HAAR: cascpath,
+        DetectorType.LBP: "lbpcascade_frontalface_improved.xml",
+        DetectorType.DNN: "models/res10_300x300_ssd_iter_140000.caffemodel",
+    }
+    detectsize = 0
+    scalefactor = 1.01
+    dpi = 300
+    jpegquality = 90
+    cache = True
+    cachedir = ".photocache"
+    cachesize = 1024
+    clearcache = False
+    sheetsperfile = 0
+    mergechunks = False
+    parallelrender = False
+    metricsjson = None
+    profile = None
+    profiletop = 20
+    verbose = False
 
     @staticmethod
     def info():
@@ -132,30 +186,99 @@ class Config:
                     imgpath: {Config.imgpath},
                     peoplecsv: {Config.peoplecsv},
                     output: {Config.output},
-                    mode: {Config.mode},
+                    modes: {", ".join(map(str, Config.modes))},
                     direction: {Config.direction},
+                    fill: {Config.fill},
                     crop: {Config.crop},
                     equalizehist: {Config.equalizehist},
-                    interactive: {Config.interactive}"""
+                    interactive: {Config.interactive},
+                    prefetch: {Config.prefetch},
+                    indexcache: {Config.indexcache},
+                    jobs: {Config.jobs},
+                    detector: {Config.detector},
+                    detectormodel: {Config.detectormodel},
+                    detectsize: {Config.detectsize},
+                    scalefactor: {Config.scalefactor},
+                    dpi: {Config.dpi},
+                    jpegquality: {Config.jpegquality},
+                    cache: {Config.cache},
+                    cachedir: {Config.cachedir},
+                    cachesize: {Config.cachesize},
+                    clearcache: {Config.clearcache},
+                    sheetsperfile: {Config.sheetsperfile},
+                    mergechunks: {Config.mergechunks},
+                    parallelrender: {Config.parallelrender},
+                    metricsjson: {Config.metricsjson},
+                    profile: {Config.profile},
+                    profiletop: {Config.profiletop},
+                    verbose: {Config.verbose}"""
 
     @staticmethod
     def setup(args):
         Config.imgpath = args.imgpath
         Config.peoplecsv = args.peoplecsv
-        Config.mode = args.mode
+        Config.modes = args.mode
+        Config.mode = Config.modes[0]
 
         if hasattr(args, 'output') and args.output is not None:
             Config.output = args.output
         else:
-            Config.output = f"output-{Config.mode}.pdf"
+            Config.output = "output-<mode>.pdf"
 
         Config.direction = args.direction
+        Config.fill = args.fill
         Config.crop = args.crop
         Config.equalizehist = args.equalizehist
         Config.interactive = args.interactive
+        Config.prefetch = max(args.prefetch, 1)
+        Config.indexcache = args.index_cache
+        Config.jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+        Config.detector = args.detector
+        if hasattr(args, 'detector_model') and args.detector_model is not None:
+            Config.detectormodel = args.detector_model
+        else:
+            Config.detectormodel = Config.DETECTOR_MODELS[Config.detector]
+        Config.detectsize = args.detect_size
+        Config.scalefactor = args.scale_factor
+        Config.dpi = args.dpi
+        Config.jpegquality = args.jpeg_quality
+        Config.cache = not args.no_cache
+        Config.cachedir = args.cache_dir
+        Config.cachesize = args.cache_size
+        Config.clearcache = args.clear_cache
+        Config.sheetsperfile = args.sheets_per_file
+        Config.mergechunks = args.merge_chunks
+        Config.parallelrender = args.parallel_render
+        Config.metricsjson = args.metrics_json
+        Config.profile = args.profile
+        Config.profiletop = args.profile_top
+        Config.verbose = args.verbose
 
         Config.spacing = ContentSpacing(Config.mode, Config.direction)
 
+    @staticmethod
+    def output_path(mode):
+        """Output file of the printing mode"""
+        if '<mode>' in Config.output:
+            return Config.output.replace('<mode>', str(mode))
+
+        if len(Config.modes) > 1:
+            # More outputs cannot be written to one file
+            root, ext = os.path.splitext(Config.output)
+            return f"{root}-{mode}{ext}"
+
+        return Config.output
+
+    @staticmethod
+    def dump():
+        """Snapshot of the configuration, e.g. to pass it to worker processes"""
+        return {k: v for k, v in vars(Config).items() if not k.startswith('_') and not isinstance(v, staticmethod)}
+
+    @staticmethod
+    def load(config):
+        for k, v in config.items():
+            setattr(Config, k, v)
+
 
 
 #                                                 ESNcard
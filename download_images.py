@@ -1,21 +1,26 @@
 #!/usr/bin/env python3
 
+import argparse
 import csv
-import imghdr
+import hashlib
+import json
 import os
-import sys
+import time
+from io import BytesIO
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from shutil import move
 from tempfile import mkstemp
 import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dateutil.relativedelta import relativedelta
 
+from profiling import Profiler
+
 SCOPES = [
     'https://www.googleapis.com/auth/drive.file',
     'https://www.googleapis.com/auth/drive',
@@ -23,35 +28,100 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive.metadata'
 ]
 
+DRIVE_URL = "https://www.googleapis.com/drive/v3/files/{}?alt=media"
+
+CSV_HEADER = "name,country,D0,D1,M0,M1,Y0,Y1,TD0,TD1,TM0,TM1,TY0,TY1,before_arrival\n"
+
+TIMESTAMP_IDX = 0
+EMAIL_IDX = 1
+NAME_IDX = 2
+COUNTRY_IDX = 3
+DATEOFBIRTH_IDX = 4
+PHOTOURL_IDX = 5
+LA_IDX = 6
+REFERRAL_IDX = 7
+BEFOREARRIVAL_IDX = 8
+
+PICTURES_DIR = 'pictures'
+
 credentials = None
-if os.path.exists('token.pickle'):
-    with open('token.pickle', 'rb') as token:
-        credentials = pickle.load(token)
-
-# If there are no (valid) credentials available, let the user log in.
-if not credentials or not credentials.valid:
-    if credentials and credentials.expired and credentials.refresh_token:
-        credentials.refresh(Request())
-    else:
-        flow = InstalledAppFlow.from_client_secrets_file('client_secret.json', SCOPES)
-        credentials = flow.run_local_server(port=0)
-    # Save the credentials for the next run
-    with open('token.pickle', 'wb') as token:
-        pickle.dump(credentials, token)
-
-service = build('drive', 'v3', credentials=credentials)
-
-
-def download_file_from_google_drive(file_id, destination):
-    response = requests.get(
-        "https://www.googleapis.com/drive/v3/files/{}?alt=media".format(file_id),
-        params={'id': id},
-        stream=True,
-        headers={'Authorization': 'Bearer {}'.format(credentials.token)},
-        timeout=5
+profiler = None
+
+
+def get_credentials():
+    """Load (or ask the user for) Google credentials, only once and only when needed"""
+    global credentials
+
+    if credentials is not None and credentials.valid:
+        return credentials
+
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+
+    if credentials is None and os.path.exists('token.pickle'):
+        with open('token.pickle', 'rb') as token:
+            credentials = pickle.load(token)
+
+    # If there are no (valid) credentials available, let the user log in.
+    if not credentials or not credentials.valid:
+        if credentials and credentials.expired and credentials.refresh_token:
+            credentials.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file('client_secret.json', SCOPES)
+            credentials = flow.run_local_server(port=0)
+        # Save the credentials for the next run
+        with open('token.pickle', 'wb') as token:
+            pickle.dump(credentials, token)
+
+    return credentials
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('csv_file', help='CSV file downloaded from the form.')
+    parser.add_argument('out_file', nargs='?', default='students.csv', help='CSV file with students for generate.py.')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='Number of concurrent downloads.')
+    parser.add_argument('--retries', type=int, default=5, help='Number of retries of a download on connection errors, 429 and 5xx.')
+    parser.add_argument('--timeout', type=float, default=30, help='Timeout of a single request in seconds.')
+    parser.add_argument('--incremental', action='store_true', help='Download only new or changed form rows, resume interrupted runs. OUT_FILE is rewritten from the manifest.')
+    parser.add_argument('--manifest', default='download-manifest.json', help='Manifest of processed form rows used in incremental mode.')
+    parser.add_argument('--drive-url', default=DRIVE_URL, help='Download URL template, e.g. of a local stand-in server.')
+    parser.add_argument('--profile', nargs='?', const='download_images.pstats', help='Run under cProfile, download threads included, and write the profile to this file (download_images.pstats if no file is given) and collapsed stacks for flame graphs next to it.')
+    parser.add_argument('--profile-top', type=int, default=20, help='Number of the most time consuming functions printed with --profile.')
+    return parser.parse_args(argv)
+
+
+def create_session(jobs, retries, authorize=True):
+    """One HTTP session shared by all download threads, with connection pooling and retries.
+
+    Google credentials are sent only if authorize is set, a local stand-in server does not need them.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+        raise_on_status=False
     )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=jobs, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if authorize:
+        session.headers['Authorization'] = 'Bearer {}'.format(get_credentials().token)
+    return session
+
+
+def is_drive_url(url):
+    return url.startswith(DRIVE_URL.split('/drive/')[0] + '/')
+
+
+def download_file_from_google_drive(session, url, file_id, destination, timeout):
+    with session.get(url.format(file_id), stream=True, timeout=timeout) as response:
+        response.raise_for_status()
 
-    save_response_content(response, destination)
+        return save_response_content(response, destination)
 
 
 def get_confirm_token(response):
@@ -62,47 +132,185 @@ def get_confirm_token(response):
     return None
 
 
+def sniff_image_type(head):
+    """Image type (file extension) recognized from the first bytes of the file"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head.startswith(b'BM'):
+        return 'bmp'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'heic', b'heix', b'hevc', b'hevx', b'mif1', b'msf1'):
+        return 'heic'
+    if head.startswith(b'%PDF'):
+        return 'pdf'
+    return None
+
+
+def encode_jpeg(img):
+    import cv2
+
+    ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not ok:
+        raise ValueError("Could not encode the photo to JPEG!")
+    return buf.tobytes()
+
+
+def webp_to_jpeg(data):
+    import cv2
+    import numpy as np
+
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode the WebP photo!")
+    return encode_jpeg(img)
+
+
+def heic_to_jpeg(data):
+    # Optional dependency, HEIC photos are kept as they are without it
+    from PIL import Image
+    from pillow_heif import register_heif_opener
+
+    register_heif_opener()
+    out = BytesIO()
+    Image.open(BytesIO(data)).convert('RGB').save(out, 'JPEG', quality=95)
+    return out.getvalue()
+
+
+def pdf_to_jpeg(data):
+    # Optional dependency, PDF uploads are kept as they are without it
+    import cv2
+    import fitz
+    import numpy as np
+
+    with fitz.open(stream=data, filetype='pdf') as doc:
+        png = doc[0].get_pixmap(dpi=300).tobytes('png')
+    return encode_jpeg(cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR))
+
+
+# Types generate.py cannot read, converted to JPEG right after download
+CONVERTERS = {
+    'webp': webp_to_jpeg,
+    'heic': heic_to_jpeg,
+    'pdf': pdf_to_jpeg,
+}
+
+# Extensions of saved photos, as recognized by sniff_image_type()
+SAVED_TYPES = ('jpg', 'png', 'gif', 'bmp', 'tiff', 'webp', 'heic', 'pdf')
+
+
+file_mode = None
+
+
+def get_file_mode():
+    """Permissions of files created by open(), mkstemp() creates them readable by the owner only.
+
+    The umask can only be read by setting it, so it is read once, before any download thread starts.
+    """
+    global file_mode
+
+    if file_mode is None:
+        umask = os.umask(0o077)
+        os.umask(umask)
+        file_mode = 0o666 & ~umask
+    return file_mode
+
+
+def create_temp(path, **kwargs):
+    """Temporary file next to the path, to be renamed to it, with the permissions open() would give it"""
+    fh, tmppath = mkstemp(dir=os.path.dirname(os.path.abspath(path)), **kwargs)
+    os.fchmod(fh, get_file_mode())
+    return fh, tmppath
+
+
+def write_atomic(path, chunks):
+    """Write chunks to a temporary file next to the path and rename it at once"""
+    fh, tmppath = create_temp(path, prefix='.', suffix='.part')
+    try:
+        with os.fdopen(fh, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmppath, path)
+    except BaseException:
+        os.remove(tmppath)
+        raise
+
+
 def save_response_content(response, destination):
+    """Stream the response to `destination` with extension of the sniffed image type.
+
+    Returns the final path, whether generate.py can use the photo and SHA-256 of the downloaded data.
+    """
     CHUNK_SIZE = 32768
 
-    with open(destination, "wb") as f:
+    sha256 = hashlib.sha256()
+
+    def chunks():
         for chunk in response.iter_content(CHUNK_SIZE):
             if chunk:  # filter out keep-alive new chunks
-                f.write(chunk)
-
-
-total_lines = 0
+                sha256.update(chunk)
+                yield chunk
+
+    # Read just enough of the data to recognize the image type
+    stream = chunks()
+    head = b''
+    for chunk in stream:
+        head += chunk
+        if len(head) >= 32:
+            break
+
+    file_type = sniff_image_type(head)
+    data = chain([head], stream)
+
+    if file_type in CONVERTERS:
+        raw = b''.join(data)
+        try:
+            data = [CONVERTERS[file_type](raw)]
+            file_type = 'jpg'
+        except ImportError as e:
+            print(f"Couldn't convert {file_type} picture to JPEG ({e.name} is not installed), please convert it manually for " + destination)
+            data = [raw]
+        except Exception as e:
+            # Kept as downloaded, so it is not fetched again and the operator can fix it
+            print(f"Couldn't convert {file_type} picture to JPEG ({e}), please convert it manually for " + destination)
+            data = [raw]
+
+    if not file_type:
+        print(
+            "Couldn't find out the picture type, please add it manually to the end of the filename for " + destination)
+        write_atomic(destination, data)
+        return destination, False, sha256.hexdigest()
+
+    path = destination + '.' + file_type
+    write_atomic(path, data)
+
+    # Not converted, generate.py cannot use it
+    return path, file_type not in CONVERTERS, sha256.hexdigest()
 
 
 def replace_and_count(file_path, pattern, subst):
-    global total_lines
+    total_lines = 0
     # Create temp file
-    fh, abs_path = mkstemp()
+    fh, abs_path = create_temp(file_path)
     with os.fdopen(fh, 'w', encoding='utf-8') as new_file:
         with open(file_path, encoding='utf-8') as old_file:
             for line in old_file:
                 new_file.write(line.replace(pattern, subst))
                 total_lines += 1
-    # Remove original file
-    os.remove(file_path)
-    # Move new file
-    move(abs_path, file_path)
-
+    # Replace the original file
+    os.replace(abs_path, file_path)
 
-line_number = 0
+    return total_lines
 
-if len(sys.argv) != 2 and len(sys.argv) != 3:
-    print('ERROR: Run as "python ' + sys.argv[0] + ' CSV_FILE [OUT_FILE]"')
-    sys.exit(1)
 
-replace_and_count(sys.argv[1], '","', '";"')
-
-
-def open_output():
-    if len(sys.argv) == 3:
-        return open(sys.argv[2], "a", encoding='utf-8')
-    else:
-        return open("students.csv", "a", encoding='utf-8')
+def open_output(path):
+    return open(path, "a", encoding='utf-8')
 
 
 def parse_name(name) -> str:
@@ -143,62 +351,258 @@ def parse_country(country) -> str:
     return country
 
 
-csv_output = open_output()
+class Progress:
+    """Counters of finished downloads"""
+
+    def __init__(self):
+        self.done = 0
+        self.failed = 0
+        self.unknown = 0
+        self.start = time.monotonic()
+
+    def report(self, name, total, failed=False, unknown=False):
+        self.done += 1
+        self.failed += failed
+        self.unknown += unknown
+        print(f"[{self.done}/{total}] " + name + (" FAILED" if failed else ""))
+
+    def summary(self):
+        elapsed = time.monotonic() - self.start
+        ok = self.done - self.failed - self.unknown
+        print(f"Downloaded {ok} photos, {self.unknown} of unknown type, {self.failed} failed in {elapsed:.1f} s.")
+
+
+class Manifest:
+    """Record of processed form rows for incremental downloads.
+
+    Rows are keyed by timestamp and email. Each entry remembers the hash of the row,
+    the line written to the output CSV and the downloaded photo with its hash. Photos
+    generate.py cannot use (unknown type, not converted) are recorded too, they are left
+    to the operator to fix by hand and not downloaded again while the Drive file is the same.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.saved = time.monotonic()
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(line):
+        return line[TIMESTAMP_IDX] + "|" + line[EMAIL_IDX]
+
+    @staticmethod
+    def row_hash(line):
+        return hashlib.sha256(json.dumps(line).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def has_photo(entry):
+        # An unusable photo may have been renamed or converted by the operator since
+        return bool(entry['photo'] and (os.path.exists(entry['photo']) or not entry.get('usable', True)))
+
+    def is_done(self, key, rowhash):
+        entry = self.entries.get(key)
+        return bool(entry and entry['row'] == rowhash and Manifest.has_photo(entry))
+
+    def reusable_photo(self, key, file_id, name):
+        """Photo saved before from the same Drive file as (path, usable, sha256), if any, renamed if the name has changed"""
+        entry = self.entries.get(key)
+        if not (entry and entry['file_id'] == file_id and Manifest.has_photo(entry)):
+            return None, None, None
+
+        usable = entry.get('usable', True)
+        if not os.path.exists(entry['photo']):
+            return entry['photo'], usable, entry['sha256']
+
+        # Files of unknown type are saved without an extension
+        ext = os.path.splitext(entry['photo'])[1]
+        if ext[1:] not in SAVED_TYPES:
+            ext = ''
+        photo = os.path.join(PICTURES_DIR, name + ext)
+        if photo != entry['photo']:
+            # generate.py looks the photo up by the name in the CSV
+            os.replace(entry['photo'], photo)
+        return photo, usable, entry['sha256']
+
+    def superseded_photo(self, key):
+        """Photo of the row which is going to be replaced by a new download, if any"""
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        # The previous download may have failed, the photo before it is still waiting for its replacement
+        return entry['photo'] or entry.get('superseded')
+
+    def replace_photo(self, key, photo, usable, sha256):
+        """Record the downloaded photo of the row and remove the one it replaces.
+
+        The replaced photo may have another extension or name, generate.py would find
+        two photos of the person then.
+        """
+        entry = self.entries[key]
+        superseded = entry.pop('superseded', None)
+        if superseded and superseded != photo and os.path.exists(superseded):
+            os.remove(superseded)
+        entry.update(photo=photo, usable=usable, sha256=sha256)
+
+    def keep_only(self, keys):
+        """Forget rows which are not in the form export anymore, so they are left out of the output CSV"""
+        for key in set(self.entries) - set(keys):
+            del self.entries[key]
+
+    def save(self, force=True):
+        # Saving after every download would be too slow for big forms
+        if not force and time.monotonic() - self.saved < 1:
+            return
+
+        fh, tmppath = create_temp(self.path)
+        with os.fdopen(fh, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmppath, self.path)
+        self.saved = time.monotonic()
+
+    def write_output(self, path):
+        """Write the output CSV with all rows from the manifest"""
+        fh, tmppath = create_temp(path)
+        with os.fdopen(fh, 'w', encoding='utf-8') as f:
+            f.write(CSV_HEADER)
+            for entry in self.entries.values():
+                f.write(entry['csv'])
+        os.replace(tmppath, path)
+
+
+def download_photo(session, args, file_id, name):
+    return download_file_from_google_drive(session, args.drive_url, file_id, os.path.join(PICTURES_DIR, name), args.timeout)
+
+
+def download(args):
+    """Download photos of all students in the form export and write the CSV for generate.py"""
+    line_number = 0
+    # The umask is changed for a moment to be read, not to be done while download threads run
+    get_file_mode()
+    total_lines = replace_and_count(args.csv_file, '","', '";"')
+
+    # Credentials and the session are created only when there is something to download
+    session = None
+    executor = ThreadPoolExecutor(max_workers=args.jobs)
+    downloads = {}
+    progress = Progress()
+
+    if args.incremental:
+        manifest = Manifest(args.manifest)
+        csv_output = None
+        # Rows of the current form export
+        keys = []
+    else:
+        manifest = None
+        csv_output = open_output(args.out_file)
+
+    with open(args.csv_file, "r", encoding='utf-8') as f:
+        csv_reader = csv.reader(f, delimiter=',')
+        dirName = PICTURES_DIR
+        try:
+            # Create target Directory
+            os.mkdir(dirName)
+            print("Directory " + dirName + " Created ")
+        except:
+            print("Directory " + dirName + " already exists")
+        for line in csv_reader:
+            if line_number == 0:
+                if csv_output:
+                    csv_output.write(CSV_HEADER)
+            else:
+                if manifest:
+                    key = Manifest.key(line)
+                    rowhash = Manifest.row_hash(line)
+                    keys.append(key)
+                    if manifest.is_done(key, rowhash):
+                        line_number += 1
+                        continue
+
+                print(str(line_number) + "/" + str(total_lines - 1))
+                print(line)
+                name = parse_name(line[NAME_IDX])
+                country = parse_country(line[COUNTRY_IDX])
+
+                birth_date = datetime.strptime(line[DATEOFBIRTH_IDX], "%d.%m.%Y").date()
+                today = datetime.now()
+                age = relativedelta(datetime.now(), birth_date).years
+                if age < 18:
+                    print("ERROR: " + name + " younger than 18! (" + str(age) + ")")
+
+                csv_line = (
+                    f'\"{name}\",\"{country}\",'
+                    f'{",".join(birth_date.strftime("%d%m%y"))},'
+                    f'{",".join(today.strftime("%d%m%y"))},'
+                    f'{line[BEFOREARRIVAL_IDX]}\n'
+                )
+                file_id = line[PHOTOURL_IDX][line[PHOTOURL_IDX].find("id=") + 3:]
+
+                if manifest:
+                    photo, usable, sha256 = manifest.reusable_photo(key, file_id, name)
+                    superseded = None if photo else manifest.superseded_photo(key)
+                    manifest.entries[key] = {'row': rowhash, 'csv': csv_line, 'file_id': file_id,
+                                             'photo': photo, 'usable': usable, 'sha256': sha256,
+                                             'superseded': superseded}
+                    if photo:
+                        line_number += 1
+                        continue
+                else:
+                    csv_output.write(csv_line)
 
-with open(sys.argv[1], "r", encoding='utf-8') as f:
-    csv_reader = csv.reader(f, delimiter=',')
-    dirName = 'pictures'
-    try:
-        # Create target Directory
-        os.mkdir(dirName)
-        print("Directory " + dirName + " Created ")
-    except:
-        print("Directory " + dirName + " already exists")
-    for line in csv_reader:
-        if line_number == 0:
-            csv_output.write("name,country,D0,D1,M0,M1,Y0,Y1,")
-            csv_output.write("TD0,TD1,TM0,TM1,TY0,TY1,before_arrival\n")
-        else:
-            TIMESTAMP_IDX = 0
-            EMAIL_IDX = 1
-            NAME_IDX = 2
-            COUNTRY_IDX = 3
-            DATEOFBIRTH_IDX = 4
-            PHOTOURL_IDX = 5
-            LA_IDX = 6
-            REFERRAL_IDX = 7
-            BEFOREARRIVAL_IDX = 8
-
-            print(str(line_number) + "/" + str(total_lines - 1))
-            print(line)
-            name = parse_name(line[NAME_IDX])
-            country = parse_country(line[COUNTRY_IDX])
-
-            birth_date = datetime.strptime(line[DATEOFBIRTH_IDX], "%d.%m.%Y").date()
-            today = datetime.now()
-            age = relativedelta(datetime.now(), birth_date).years
-            if age < 18:
-                print("ERROR: " + name + " younger than 18! (" + str(age) + ")")
-
-            csv_output.write(
-                f'\"{name}\",\"{country}\",'
-                f'{",".join(birth_date.strftime("%d%m%y"))},'
-                f'{",".join(today.strftime("%d%m%y"))},'
-                f'{line[BEFOREARRIVAL_IDX]}\n'
-            )
-            file_id = line[PHOTOURL_IDX][line[PHOTOURL_IDX].find("id=") + 3:]
+                if session is None:
+                    session = create_session(args.jobs, args.retries, is_drive_url(args.drive_url))
+                task = profiler.task(download_photo) if profiler else download_photo
+                downloads[executor.submit(task, session, args, file_id, name)] = (name, key if manifest else None)
+            line_number += 1
+            if csv_output:
+                csv_output.flush()
 
+    if csv_output:
+        csv_output.close()
+    if manifest:
+        manifest.keep_only(keys)
+
+    try:
+        for future in as_completed(downloads):
+            name, key = downloads[future]
             try:
-                download_file_from_google_drive(file_id, name)
-                file_type = imghdr.what(name)
-                if not file_type:
-                    print(
-                        "Couldn't find out the picture type, please add it manually to the end of the filename for " + name)
-                else:
-                    move(name, os.path.join('pictures', name + '.' + file_type))
+                photo, usable, sha256 = future.result()
+                progress.report(name, len(downloads), unknown=not usable)
             except Exception as e:
                 print("ERROR: Exception trown. ", e)
-        line_number += 1
-        csv_output.flush()
+                progress.report(name, len(downloads), failed=True)
+                continue
+
+            if manifest:
+                manifest.replace_photo(key, photo, usable, sha256)
+                manifest.save(force=False)
+    finally:
+        # Keep what has been downloaded so far, an interrupted run is resumed next time
+        executor.shutdown(cancel_futures=True)
+        if session:
+            session.close()
+        if manifest:
+            manifest.save()
+            manifest.write_output(args.out_file)
+
+    progress.summary()
+
+    return progress
+
+
+def main(argv=None):
+    global profiler
+
+    args = parse_args(argv)
+    if args.profile:
+        profiler = Profiler(args.profile, args.profile_top)
+        profiler.run(download, args)
+    else:
+        download(args)
+
 
-csv_output.close()
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,116 @@
 import cv2 as cv
 import numpy as np
 import logging
-import matplotlib.pyplot as plt
+import os
 
-from config import EqualizeHistMode, PhotoSize, Config
-from tools import retrieve_name
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from config import DetectorSettings, DetectorType, EqualizeHistMode, PhotoSize, Config
 
 logger = logging.getLogger(__name__)
 
+class CascadeBackend:
+    """Haar or LBP cascade classifier, searches faces in an equalized grayscale image"""
+    color = False
+
+    def __init__(self, path, scalefactor, minneighbors):
+        self.scalefactor = scalefactor
+        self.minneighbors = minneighbors
+        self.cascade = cv.CascadeClassifier(path)
+
+        if self.cascade.empty():
+            raise ValueError(f"Cascade file '{path}' could not be loaded!")
+
+    def detect(self, img, minsize):
+        """Faces as rectangles [[x, y, w, h]]"""
+        return self.cascade.detectMultiScale(
+            img,
+            scaleFactor=self.scalefactor,
+            minNeighbors=self.minneighbors,
+            minSize=(minsize, minsize),
+            flags = cv.CASCADE_SCALE_IMAGE
+        )
+
+class DNNBackend:
+    """ResNet-10 SSD face detector (res10_300x300) run by the OpenCV DNN module.
+
+    Searches faces in the color image. The network description `deploy.prototxt`
+    has to be next to the Caffe model file.
+    """
+    color = True
+
+    INPUT_SIZE = 300
+    MEAN = (104.0, 177.0, 123.0)
+
+    def __init__(self, path):
+        config = os.path.join(os.path.dirname(path), 'deploy.prototxt')
+        if not os.path.isfile(config):
+            raise FileNotFoundError(f"Network description '{config}' of the model '{path}' does not exist!")
+
+        self.net = cv.dnn.readNetFromCaffe(config, path)
+
+    def detect(self, img, minsize):
+        """Faces as rectangles [[x, y, w, h]], the most confident first"""
+        h, w = img.shape[:2]
+        size = DNNBackend.INPUT_SIZE
+        self.net.setInput(cv.dnn.blobFromImage(cv.resize(img, (size, size)), 1.0, (size, size), DNNBackend.MEAN))
+
+        # [[image id, class, confidence, x1, y1, x2, y2]] with coordinates relative to the image size
+        found = self.net.forward()[0, 0]
+        found = found[found[:, 2] >= DetectorSettings.dnnConfidence]
+        found = found[np.argsort(-found[:, 2])]
+
+        corners = np.clip(found[:, 3:7] * (w, h, w, h), 0, (w, h, w, h)).astype(int)
+        rects = np.hstack((corners[:, :2], corners[:, 2:] - corners[:, :2]))
+        return rects[(rects[:, 2] >= minsize) & (rects[:, 3] >= minsize)]
+
 class FaceDetector:
+    """Face detector with a loaded model.
+
+    Create it once (per process) and call `process()` for each image, the model
+    file is parsed only when the detector is created. The faces are searched by
+    a backend chosen by `detector` (DetectorType), the rest of the processing is the same.
+
+    With `detectsize` set, faces are searched in a copy of the image downscaled
+    so its longest side has `detectsize` pixels. Found rectangles are mapped back,
+    so cropping is still done at full resolution.
+    """
+    _instances = {}
+
+    GRAY_BUFFERS = 4        # Number of image sizes whose grayscale buffers are kept for reuse
+    PREFETCH = 4            # Images read ahead by run_batch()
+
+    # Versions of the photo offered in interactive mode
+    VARIANTS = ('original', 'cropped', 'CLAHE', 'HEQ YUV', 'HEQ HSV', 'other')
+    PREVIEW_SIZE = 400      # Longest side of the previews in pixels
+
+    def __init__(self, modelpath, detectsize = 0, scalefactor = 1.01, detector = DetectorType.HAAR):
+        if not os.path.isfile(modelpath):
+            raise FileNotFoundError(f"Model file '{modelpath}' of the {detector} detector does not exist!")
+
+        self.modelpath = modelpath
+        self.detectsize = detectsize
+        self.scalefactor = scalefactor
+        self.detector = detector
+        self.buffers = {}   # (height, width) -> (grayscale, equalized) buffers, the most recently used last
+
+        if detector == DetectorType.DNN:
+            self.backend = DNNBackend(modelpath)
+        else:
+            self.backend = CascadeBackend(modelpath, scalefactor, DetectorSettings.minNeighbors[detector])
+
+        logger.debug(f"Model '{modelpath}' of the {detector} detector loaded.")
+
+    @staticmethod
+    def get(modelpath, detectsize = 0, scalefactor = 1.01, detector = DetectorType.HAAR):
+        """Detector for the model and settings, shared within the process"""
+        key = (modelpath, detectsize, scalefactor, detector)
+        if key not in FaceDetector._instances:
+            FaceDetector._instances[key] = FaceDetector(modelpath, detectsize, scalefactor, detector)
+        return FaceDetector._instances[key]
+
     @staticmethod
     def expand_rects(rects):
         # Expand the square around a face by some relative size to make space for the rest of the head
@@ -35,19 +137,28 @@ class FaceDetector:
 
         return rects
 
-    @staticmethod
-    def detect(img, cascade, expand = True):
-        rects = cascade.detectMultiScale(
-            img,
-            scaleFactor=1.01,
-            minNeighbors=50,
-            minSize=(100, 100),
-            flags = cv.CASCADE_SCALE_IMAGE
-        )
+    def detect(self, img, expand = True):
+        """Faces as rectangles [[x1, y1, x2, y2]] in the grayscale (or BGR for backends working in color) image"""
+        h,w = img.shape[:2]
+
+        # Search on a downscaled copy, if requested
+        scale = 1.0
+        small = img
+        if self.detectsize and max(h, w) > self.detectsize:
+            scale = self.detectsize / max(h, w)
+            small = cv.resize(img, (round(w * scale), round(h * scale)), interpolation=cv.INTER_AREA)
+
+        minSize = max(round(DetectorSettings.minFaceSize * scale), 24)
+
+        rects = self.backend.detect(small, minSize)
 
         if len(rects) == 0:
             return []
 
+        # Map the rectangles back to the full resolution
+        if scale != 1.0:
+            rects = np.round(rects / scale).astype(rects.dtype)
+
         # FIXME hack for 'more' faces in a photo
         #rects = np.array([rects[0,:]])
 
@@ -60,7 +171,6 @@ class FaceDetector:
         rects[:,2:] += rects[:,:2]
 
         # Make sure the rectangle is not larger than the image
-        h,w = img.shape
         rects[rects[..., 2] > w, 2] = w
         rects[rects[..., 3] > h, 3] = h
             
@@ -83,45 +193,27 @@ class FaceDetector:
 
     @staticmethod
     def hist_eq_other(img_in):
-        #https://stackoverflow.com/a/62980480
-
-        # segregate color streams
-        b, g, r = cv.split(img_in)
-        h_b, bin_b = np.histogram(b.flatten(), 256, [0, 256])
-        h_g, bin_g = np.histogram(g.flatten(), 256, [0, 256])
-        h_r, bin_r = np.histogram(r.flatten(), 256, [0, 256])
-        # calculate cdf
-        cdf_b = np.cumsum(h_b)
-        cdf_g = np.cumsum(h_g)
-        cdf_r = np.cumsum(h_r)
-
-        # mask all pixels with value=0 and replace it with mean of the pixel values
-        cdf_m_b = np.ma.masked_equal(cdf_b, 0)
-        cdf_m_b = (cdf_m_b - cdf_m_b.min()) * 255 / (cdf_m_b.max() - cdf_m_b.min())
-        cdf_final_b = np.ma.filled(cdf_m_b, 0).astype('uint8')
-
-        cdf_m_g = np.ma.masked_equal(cdf_g, 0)
-        cdf_m_g = (cdf_m_g - cdf_m_g.min()) * 255 / (cdf_m_g.max() - cdf_m_g.min())
-        cdf_final_g = np.ma.filled(cdf_m_g, 0).astype('uint8')
-
-
-        cdf_m_r = np.ma.masked_equal(cdf_r, 0)
-        cdf_m_r = (cdf_m_r - cdf_m_r.min()) * 255 / (cdf_m_r.max() - cdf_m_r.min())
-        cdf_final_r = np.ma.filled(cdf_m_r, 0).astype('uint8')
-        # merge the images in the three channels
-        img_b = cdf_final_b[b]
-        img_g = cdf_final_g[g]
-        img_r = cdf_final_r[r]
-
-        img_out = cv.merge((img_b, img_g, img_r))
-        # validation
-        equ_b = cv.equalizeHist(b)
-        equ_g = cv.equalizeHist(g)
-        equ_r = cv.equalizeHist(r)
-        equ = cv.merge((equ_b, equ_g, equ_r))
-        # print(equ)
-        # cv2.imwrite('output_name.png', equ)
-        return img_out
+        """Equalize the histogram of every color channel separately.
+
+        Same result as https://stackoverflow.com/a/62980480, but the three lookup tables
+        are built side by side from per-channel histograms and applied by a single cv.LUT
+        on the BGR image.
+        """
+        # histograms of the B, G and R channels as columns, no channel copies;
+        # calcHist returns (256, 1) on OpenCV 4 and (256,) on OpenCV 5, so flatten each
+        hist = np.stack([cv.calcHist([img_in], [c], None, [256], [0, 256]).ravel() for c in range(3)], axis=1)
+        cdf = np.cumsum(hist.astype(np.int64), axis=0)
+
+        # stretch the nonzero part of each cdf to 0..255, values not present in the image map to 0
+        cdf_min = np.where(cdf > 0, cdf, cdf[-1]).min(axis=0)
+        cdf_max = cdf[-1]
+        span = cdf_max - cdf_min
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lut = (cdf - cdf_min) * 255 / span
+        # single-valued channels (span 0) map to 0 as well
+        lut[(cdf == 0) | (span == 0)] = 0
+
+        return cv.LUT(img_in, lut.astype(np.uint8).reshape(1, 256, 3))
 
     @staticmethod
     def hist_eq_clahe(img):
@@ -149,21 +241,47 @@ class FaceDetector:
 
     @staticmethod
     def run(imgpath, cascpath):
-        # Prepare vars
-        img = cv.imread(imgpath)
-        faceCascade = cv.CascadeClassifier(cascpath)
-
-        gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
-        gray = cv.equalizeHist(gray)
+        return FaceDetector.get(cascpath, Config.detectsize, Config.scalefactor, Config.detector).process(imgpath)
 
-        # Run facial recognition
-        rects = FaceDetector.detect(gray, faceCascade)
+    @staticmethod
+    def imread(imgpath):
+        with metrics.stage('imread'):
+            img = cv.imread(imgpath)
+        if img is None:
+            raise IOError(f"Could not read image '{imgpath}'!")
+        return img
+
+    def gray(self, img):
+        """Equalized grayscale version of the BGR image.
+
+        It is written into buffers reused for images of the same size, so it is valid
+        only until the next call.
+        """
+        shape = img.shape[:2]
+        buffers = self.buffers.pop(shape, None)
+        if buffers is None:
+            buffers = (np.empty(shape, np.uint8), np.empty(shape, np.uint8))
+            if len(self.buffers) >= FaceDetector.GRAY_BUFFERS:
+                del self.buffers[next(iter(self.buffers))]
+        self.buffers[shape] = buffers
+
+        gray, equalized = buffers
+        cv.cvtColor(img, cv.COLOR_BGR2GRAY, dst=gray)
+        cv.equalizeHist(gray, dst=equalized)
+        return equalized
+
+    def find_face(self, img):
+        """Rectangles [[x1, y1, x2, y2]] of the face to crop to, None if there is no face"""
+        with metrics.stage('detect'):
+            # Run facial recognition
+            rects = self.detect(img if self.backend.color else self.gray(img))
 
         # Process found faces
-        logger.debug(f"Found {len(rects)} faces!")
+        logger.debug("Found %d faces!", len(rects))
+        metrics.count('faces_none' if len(rects) == 0 else 'faces_one' if len(rects) == 1 else 'faces_many')
 
         if len(rects) == 0:
-            return img
+            return None
         elif len(rects) > 1:
             # # We found more faces...choose one
             # vis_faces = img.copy()
@@ -180,75 +298,156 @@ class FaceDetector:
             # cv.destroyAllWindows()
             rects = rects[[0], :]
 
-        vis = img.copy()
+        return rects
+
+    def variants(self, img):
+        """All versions of the image offered in interactive mode, in the order of VARIANTS.
+
+        Returns (variants, face rectangles). Without a face, only the original is offered.
+        """
+        rects = self.find_face(img)
+        if rects is None:
+            return [img], None
+
+        # Crop around face
+        with metrics.stage('crop'):
+            cropped = FaceDetector.crop(img, rects[0,0], rects[0,1], rects[0,2], rects[0,3])
+
+        # Different histogram equalization methods
+        with metrics.stage('equalize'):
+            return [
+                img,
+                cropped,
+                FaceDetector.hist_eq_clahe(cropped),
+                FaceDetector.hist_eq_heq_yuv(cropped),
+                FaceDetector.hist_eq_heq_hsv(cropped),
+                FaceDetector.hist_eq_other(cropped),
+            ], rects
+
+    @staticmethod
+    def previews(variants, rects, size = PREVIEW_SIZE):
+        """RGB thumbnails of the variants, the face rectangle is drawn into the original"""
+        previews = []
+        for vis in variants:
+            h, w = vis.shape[:2]
+            scale = min(size / max(h, w), 1.0)
+            if scale < 1.0:
+                vis = cv.resize(vis, (round(w * scale), round(h * scale)), interpolation=cv.INTER_AREA)
+            previews.append(cv.cvtColor(vis, cv.COLOR_BGR2RGB))
+
+        if rects is not None:
+            scale = previews[0].shape[0] / variants[0].shape[0]
+            FaceDetector.draw_rects(previews[0], (rects * scale).astype(int), (0, 255, 0))
+
+        return previews
+
+    @staticmethod
+    def review(previews):
+        """Show the previews and ask which variant should be used, returns its index.
+
+        The last number skips the person, an exception is raised then.
+        """
+        if len(previews) == 1:
+            return 0
+
+        # matplotlib is slow to import and needed only here
+        import matplotlib.pyplot as plt
+
+        f, ax = plt.subplots(3,2)
+        for i, axi in enumerate(ax.ravel()):
+            axi.set_axis_off()
+            axi.set_title(f"{i}:{FaceDetector.VARIANTS[i]}")
+            axi.imshow(previews[i])
+        f.tight_layout()
+        plt.show(block=False)
+        plt.pause(0.001)
+
+        print(f"Which image should be used? ({len(previews)}) to skip this person.")
+        i = input("Enter one number [1]: ")
+
+        plt.close(f)
+
+        if i.isnumeric() and int(i) <= len(previews):
+            i = int(i)
+        else:
+            logger.warning(f"'{i}' is not valid! Choosing the cropped image.")
+            i = 1
+
+        if i == len(previews):
+            raise Exception("Skipping person...")
+
+        return i
+
+    def process(self, imgpath):
+        img = FaceDetector.imread(imgpath)
 
         if Config.interactive:
             # In interactive mode, do not care about other settings,
             # just compute all variants and show them.
+            variants, rects = self.variants(img)
+            return variants[FaceDetector.review(FaceDetector.previews(variants, rects))]
 
-            # Original version with rectangles printed
-            vis_rects = vis.copy()
-            FaceDetector.draw_rects(vis_rects, rects, (0, 255, 0))
+        rects = self.find_face(img)
+        if rects is None:
+            return img
 
-            # Crop around face
-            vis_cropped = FaceDetector.crop(vis, rects[0,0], rects[0,1], rects[0,2], rects[0,3])
-            
-            # Different histogram equalization methods
-            vis_eq_clahe = FaceDetector.hist_eq_clahe(vis_cropped)
-            vis_eq_heq_yuv = FaceDetector.hist_eq_heq_yuv(vis_cropped)
-            vis_eq_heq_hsv = FaceDetector.hist_eq_heq_hsv(vis_cropped)
-            vis_eq_other = FaceDetector.hist_eq_other(vis_cropped)
-
-            vislist = [vis, vis_cropped, vis_eq_clahe, vis_eq_heq_yuv, vis_eq_heq_hsv, vis_eq_other]
-
-            f, ax = plt.subplots(3,2)
-            i = 0
-            for axi in ax.ravel(): 
-                axi.set_axis_off()
-                axi.set_title(str(i) + ":" + retrieve_name(vislist[i]))
-                i += 1
-            
-            ax[0,0].imshow(cv.cvtColor(vis_rects, cv.COLOR_BGR2RGB))
-            ax[0,1].imshow(cv.cvtColor(vislist[1], cv.COLOR_BGR2RGB))
-            ax[1,0].imshow(cv.cvtColor(vislist[2], cv.COLOR_BGR2RGB))
-            ax[1,1].imshow(cv.cvtColor(vislist[3], cv.COLOR_BGR2RGB))
-            ax[2,0].imshow(cv.cvtColor(vislist[4], cv.COLOR_BGR2RGB))
-            ax[2,1].imshow(cv.cvtColor(vislist[5], cv.COLOR_BGR2RGB))
-            f.tight_layout()
-
-            print(f"Which image should be used? ({len(vislist)}) to skip this person.")
-            i = input("Enter one number [1]: ")
-
-            plt.close(f)
-
-            if i.isnumeric() and int(i) <= len(vislist):
-                i = int(i)
-            else:
-                logger.warning(f"'{i}' is not valid! Choosing the cropped image.")
-                i = 1
-            
-            if i == 6:
-                raise Exception("Skipping person...")
+        return self.adjust(img, rects)
+
+    def run_batch(self, paths, prefetch = PREFETCH):
+        """Process the images one by one, yield (path, rects, processed image) in the order of paths.
 
-            return vislist[i]
+        The next `prefetch` images are read and decoded on I/O threads while the current one
+        is processed, OpenCV releases the GIL for both. Rects are None if no face was found,
+        the image is returned as it is then. Images which cannot be read are logged and
+        yielded as (path, None, None). Interactive mode is not supported.
+        """
+        paths = iter(paths)
+        pending = deque()
 
-        # Not interactive mode, continue in your stuff
-        if Config.crop:
-            vis = FaceDetector.crop(vis, rects[0,0], rects[0,1], rects[0,2], rects[0,3])
+        with ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix='imread') as executor:
+            def submit():
+                for path in paths:
+                    pending.append((path, executor.submit(cv.imread, path)))
+                    return
+
+            for _ in range(prefetch):
+                submit()
+
+            while pending:
+                path, future = pending.popleft()
+                submit()
+
+                img = future.result()
+                if img is None:
+                    logger.error(f"!!! Could not read image '{path}'!")
+                    yield path, None, None
+                    continue
+
+                rects = self.find_face(img)
+                yield path, rects, img if rects is None else self.adjust(img, rects)
+
+    def adjust(self, img, rects):
+        """Crop and equalize the image as configured"""
+        with metrics.stage('crop'):
+            vis = img.copy()
+
+            if Config.crop:
+                vis = FaceDetector.crop(vis, rects[0,0], rects[0,1], rects[0,2], rects[0,3])
 
         if Config.equalizehist:
             # TODO https://docs.opencv.org/3.1.0/d5/daf/tutorial_py_histogram_equalization.html
 
-            if Config.equalizehist == EqualizeHistMode.CLAHE:
-                vis = FaceDetector.hist_eq_clahe(vis)
+            with metrics.stage('equalize'):
+                if Config.equalizehist == EqualizeHistMode.CLAHE:
+                    vis = FaceDetector.hist_eq_clahe(vis)
 
-            elif Config.equalizehist == EqualizeHistMode.HEQ_YUV:
-                vis = FaceDetector.hist_eq_heq_yuv(vis)
+                elif Config.equalizehist == EqualizeHistMode.HEQ_YUV:
+                    vis = FaceDetector.hist_eq_heq_yuv(vis)
 
-            elif Config.equalizehist == EqualizeHistMode.HEQ_HSV:
-                vis = FaceDetector.hist_eq_heq_hsv(vis)
+                elif Config.equalizehist == EqualizeHistMode.HEQ_HSV:
+                    vis = FaceDetector.hist_eq_heq_hsv(vis)
+
+                elif Config.equalizehist == EqualizeHistMode.OTHER:
+                    vis = FaceDetector.hist_eq_other(vis)
 
-            elif Config.equalizehist == EqualizeHistMode.OTHER:
-                vis = FaceDetector.hist_eq_other(vis)
-            
         return vis
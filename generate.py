@@ -1,61 +1,93 @@
 #!/usr/bin/env python3
 
 import argparse
-import csv
-import cv2
+import importlib.util
 import logging
 import os
-import re
 import sys
-import tempfile
+import time
 
-from datetime import date
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
-from config import PrintMode, PrintDirection, EqualizeHistMode, CardSpacing, Config
-from facedetector import FaceDetector
+import metrics
+from config import PrintMode, PrintDirection, EqualizeHistMode, FillOrder, DetectorSettings, DetectorType, Config
+from layout import LayoutEngine
 from pdfprinter import PDFPrinter, DelimiterStyle
+from people import CSVValidationError, load_people
+from photocache import PhotoCache
+from photoindex import PhotoIndex
+from profiling import Profiler
 
-logging.basicConfig(filename='/dev/stdout/',
+logging.basicConfig(stream=sys.stdout,
                     format='[%(asctime)s] %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
-                    level=logging.DEBUG)
+                    level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-class PersonInfo:
-    name = ""
-    nationality = ""
-    birthday = None
-    faculty = "VUT Brno"
-    section = "ESN VUT Brno"
-    validity = None
-    before_arrival = ""
+def setup_logging():
+    logging.getLogger().setLevel(logging.DEBUG if Config.verbose else logging.INFO)
 
-    def __init__(self, row):
-        self.parse(row)
 
-    def parse(self, row):
-        self.name = row["name"]
-        self.nationality = row["country"]
-        self.birthday = date(int("20" + row["Y0"] + row["Y1"]), int(row["M0"] + row["M1"]), int(row["D0"] + row["D1"]))       # FIXME fix the dirty year hack (20xx) - download_images.py does not export first two numbers of the year
-        self.validity = date(int("20" + row["TY0"] + row["TY1"]), int(row["TM0"] + row["TM1"]), int(row["TD0"] + row["TD1"])) # FIXME fix the dirty year hack (20xx) - download_images.py does not export first two numbers of the year
-        self.before_arrival = row["before_arrival"]
+def parse_modes(value):
+    try:
+        modes = [PrintMode(mode.strip()) for mode in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid mode(s) '{value}', choose from {', '.join(map(str, PrintMode))}")
 
+    # Keep the order, drop duplicates
+    return list(dict.fromkeys(modes))
 
 def parse_args():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-i', '--imgpath', default=Config.imgpath, help=f'Folder with images to be processed.')
     parser.add_argument('-p', '--peoplecsv', default=Config.peoplecsv, help=f'CSV file with students and their details.')
-    parser.add_argument('-o', '--output', default=argparse.SUPPRESS, help=f'Output file. (default: {Config.output})')
-    parser.add_argument('-m', '--mode', type=PrintMode, choices=list(PrintMode), default=Config.mode, help=f'Printing mode.')
+    parser.add_argument('-o', '--output', default=argparse.SUPPRESS, help=f'Output file, <mode> is replaced by the printing mode. (default: {Config.output})')
+    parser.add_argument('-m', '--mode', type=parse_modes, default=','.join(map(str, Config.modes)), help=f'Printing mode, {{{",".join(map(str, PrintMode))}}}. More modes separated by comma generate more outputs in one run, e.g. photo,text,all.')
     parser.add_argument('-d', '--direction', type=PrintDirection, choices=list(PrintDirection), default=Config.direction, help=f'Printing direction: {PrintDirection.NORMAL} - TOP -> BOTTOM, {PrintDirection.REVERSED} - BOTTOM -> TOP')
+    parser.add_argument('--fill', type=FillOrder, choices=list(FillOrder), default=Config.fill, help=f'Order in which cards fill a page: {FillOrder.ROWS} - row by row, {FillOrder.COLUMNS} - column by column')
     parser.add_argument('-e', '--equalizehist', type=EqualizeHistMode, choices=list(EqualizeHistMode), default=Config.equalizehist, help=f'Equalize histogram. Modes: \n\t{EqualizeHistMode.CLAHE} - Contrast Limited Adaptive Histogram Equalization, {EqualizeHistMode.HEQ_YUV} - Global Histogram Equalization (YUV), {EqualizeHistMode.HEQ_HSV} - Global Histogram Qqualization (HSV), {EqualizeHistMode.OTHER} - Placeholder for tests.')
     parser.add_argument('-c', '--crop', help=f'Crop images using face detection.', action='store_true')
     parser.add_argument('--interactive', help=f'Ask which image to use each time - original, or cropped.', action='store_true')
+    parser.add_argument('--prefetch', type=int, default=Config.prefetch, help=f'Number of people whose photo variants are prepared in the background in interactive mode.')
+    parser.add_argument('--detector', type=DetectorType, choices=list(DetectorType), default=Config.detector, help=f'Face detector: {DetectorType.HAAR} - Haar cascade, {DetectorType.LBP} - LBP cascade (faster), {DetectorType.DNN} - ResNet-10 SSD of OpenCV DNN (finds also rotated and backlit faces, needs deploy.prototxt next to the model).')
+    parser.add_argument('--detector-model', default=argparse.SUPPRESS, help=f'Model file of the detector. (default: {", ".join(f"{d} - {m}" for d, m in Config.DETECTOR_MODELS.items())})')
+    parser.add_argument('--detect-size', type=int, default=Config.detectsize, help=f'Search faces in the image downscaled to this longest side (in pixels). Cropping is still done in full resolution. 0 searches in full resolution.')
+    parser.add_argument('--scale-factor', type=float, default=Config.scalefactor, help=f'Scale factor of the face detection image pyramid. Higher is faster, lower finds more faces.')
+    parser.add_argument('--dpi', type=int, default=Config.dpi, help=f'Resize photos to this resolution of the printed photo before embedding. 0 embeds photos as they are.')
+    parser.add_argument('--jpeg-quality', type=int, default=Config.jpegquality, help=f'JPEG quality (0-100) of re-encoded photos.')
+    parser.add_argument('--cache-dir', default=Config.cachedir, help=f'Folder with cached processed photos.')
+    parser.add_argument('--cache-size', type=int, default=Config.cachesize, help=f'Size limit of the photo cache in MiB. Least recently used photos are removed.')
+    parser.add_argument('--no-cache', help=f'Do not use the photo cache.', action='store_true')
+    parser.add_argument('--clear-cache', help=f'Remove all photos from the cache before processing.', action='store_true')
+    parser.add_argument('--sheets-per-file', type=int, default=Config.sheetsperfile, help=f'Write the output in numbered files of this many A4 sheets, to limit memory use and lose less on a crash. 0 writes one file.')
+    parser.add_argument('--merge-chunks', help=f'Merge the numbered files into one output file at the end (requires pypdf).', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int, default=Config.jobs, help=f'Number of processes used for face detection and histogram equalization. 0 uses all cores.')
+    parser.add_argument('--parallel-render', help=f'Render groups of pages in --jobs processes and merge them into the output (requires pypdf).', action='store_true')
+    parser.add_argument('--index-cache', default=Config.indexcache, help=f'File to persist the photo index in between runs. Reused while the image folder is not modified.')
+    parser.add_argument('--metrics-json', default=Config.metricsjson, help=f'File to write the time spent in each processing stage, per person and in total, and other counters to.')
+    parser.add_argument('--profile', nargs='?', const='generate.pstats', default=Config.profile, help=f'Run under cProfile, worker processes included, and write the profile to this file (generate.pstats if no file is given) and collapsed stacks for flame graphs next to it.')
+    parser.add_argument('--profile-top', type=int, default=Config.profiletop, help=f'Number of the most time consuming functions printed with --profile.')
+    parser.add_argument('-v', '--verbose', help=f'Log debug messages.', action='store_true')
 
     args, rest = parser.parse_known_args()
     sys.argv = sys.argv[:1] + rest
 
+    if not 0 <= args.jpeg_quality <= 100:
+        parser.error(f"--jpeg-quality must be between 0 and 100, not {args.jpeg_quality}")
+    # 0 has a meaning of its own for each of them - photos embedded as they are, one file, full resolution
+    for option, value in (('--dpi', args.dpi), ('--sheets-per-file', args.sheets_per_file), ('--detect-size', args.detect_size)):
+        if value < 0:
+            parser.error(f"{option} must not be negative, not {value}")
+    # detectMultiScale needs a growing image pyramid, it fails on every photo otherwise
+    if args.scale_factor <= 1:
+        parser.error(f"--scale-factor must be greater than 1, not {args.scale_factor}")
+    if args.merge_chunks and args.sheets_per_file <= 0:
+        parser.error("--merge-chunks needs --sheets-per-file, without it there are no numbered files to merge")
+
     Config.setup(args)
+    setup_logging()
 
 def load_images():
     try:
@@ -64,9 +96,16 @@ def load_images():
         logger.error(f"Getting images from directory '{Config.imgpath}' failed.")
         sys.exit(1)
 
-def get_image(name):
-    foundImgs = [f for f in os.listdir(Config.imgpath) if re.match(rf".*{name}.*", f) and any(f.endswith(ext) for ext in Config.imgextensions)]
-    logger.debug(f"Matched photos: {foundImgs}")
+def build_index():
+    try:
+        return PhotoIndex.build(Config.imgpath, Config.imgextensions, Config.indexcache)
+    except OSError:
+        logger.error(f"Getting images from directory '{Config.imgpath}' failed.")
+        sys.exit(1)
+
+def get_image(index, name):
+    foundImgs = index.lookup(name)
+    logger.debug("Matched photos: %s", foundImgs)
 
     if len(foundImgs) == 1:
         return foundImgs[0]
@@ -83,125 +122,508 @@ def get_image(name):
     print("Which image should be used?")
     i = input("Enter one number [0]: ")
 
-    if i.isnumeric() and i < len(foundImgs) and i > 0:
+    if i.isnumeric() and int(i) < len(foundImgs):
         i = int(i)
     else:
-        logger.warning(f"'{i}' is not an integer! Choosing the first image.")
+        logger.warning(f"'{i}' is not a valid number! Choosing the first image.")
         i = 0
 
     return foundImgs[i]
 
-def do():
-    # TODO try-catch
-    pp = PDFPrinter(Config.output)
-
-    xLeftLimit = Config.spacing.xLeftLimit
-    yTopLimit = Config.spacing.yTopLimit
-    xRightLimit = Config.spacing.xRightLimit
-    yBottomLimit = Config.spacing.yBottomLimit
-    xIncrement = Config.spacing.xIncrement
-    yIncrement = Config.spacing.yIncrement
-
-    if Config.direction == PrintDirection.NORMAL:
-        xInit= xLeftLimit
-        yInit = yTopLimit
-    else:
-        xInit = xRightLimit
-        yInit = yBottomLimit
+def find_photo(index, pi):
+    with metrics.stage('lookup'):
+        foundImg = get_image(index, pi.name)
 
-    x,y = xInit, yInit
+    if foundImg is None:
+        logger.error(f"!!! Could not find an image for '{pi.name}'. Skipping photo print...")
+        metrics.count('missing_photos')
+        return None
 
-    # For debug message only.
-    i = 0
-    with open(Config.peoplecsv) as f:
-        rows = sum(1 for line in f)-1
+    return os.path.join(Config.imgpath, foundImg)
 
-    with open(Config.peoplecsv, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        data = sorted(reader, key=lambda d: (d['country'], d['name']))
-        for row in data:
-            i += 1
+def needs_processing():
+    return Config.interactive or Config.crop or Config.equalizehist
+
+def needs_reencoding():
+    return needs_processing() or Config.dpi > 0
+
+def check_detector():
+    """Exit with one clear error if model files of the detector are missing, before any work starts"""
+    files = [Config.detectormodel]
+    if Config.detector == DetectorType.DNN:
+        files.append(os.path.join(os.path.dirname(Config.detectormodel), 'deploy.prototxt'))
+
+    for path in files:
+        if not os.path.isfile(path):
+            logger.error(f"!!! File '{path}' of the {Config.detector} detector does not exist! "
+                         f"See README.md where to get it, or set it by --detector-model.")
+            sys.exit(1)
+
+def check_merging():
+    """Exit with one clear error if pypdf needed to merge parts of the output is missing, before any work starts"""
+    if importlib.util.find_spec('pypdf') is None:
+        logger.error("!!! --parallel-render and --merge-chunks need pypdf to merge the output, install it by 'pip install pypdf'.")
+        sys.exit(1)
 
-            pi = PersonInfo(row)
-
-            logger.info(f"Exporting ({i}/{rows}) {pi.name}")
-
-            # Print photo, if needed
-            if Config.mode != PrintMode.TEXT_ONLY:
-                try:
-                    foundImg = get_image(pi.name)
-
-                    # TODO refactor this if statement
-                    if foundImg is None:
-                        logger.error(f"!!! Could not find an image for '{pi.name}'. Skipping photo print...")
-                    else:
-                        imgpath = os.path.join(Config.imgpath, foundImg)
-
-                        if Config.interactive or Config.crop or Config.equalizehist:
-                            try:
-                                vis = FaceDetector.run(imgpath, "haarcascade_frontalface_default.xml")
-                                tmpfile = os.path.join(tempfile._get_default_tempdir(), next(tempfile._get_candidate_names()) + ".jpg")
-                                cv2.imwrite(tmpfile, vis)
-                                imgpath = tmpfile
-                            except Exception as e:
-                                logger.error(f"!!! FaceDetector thrown an Exception!\n{str(e)}")
-                                logger.warning(f"Skipping the person completely...")
-                                continue
-
-                        pp.set_coordintates(x, y)
-                        pp.print_photo(imgpath, pi)
-                except Exception as e:
-                    logger.error(f"!!! Could not print the image!\n{str(e)}")
-
-            # Print person info, if needed
-            if Config.mode != PrintMode.PHOTO_ONLY:
-                xText, yText = x, y
-
-                # If we print both photo and text, move init position of text next to the photo
-                if Config.mode != PrintMode.TEXT_ONLY:
-                    xText += CardSpacing.textDelta
-                    yText += CardSpacing.rowDelta
-
-                pp.set_coordintates(xText, yText)
-                pp.print_person_info(pi)
-
-            # Print person delimiter (for easier cutting of prints)
-            xDelim = x - (Config.spacing.xSpacing / 2.0) # get between cols
-            yDelim = y
-
-            if Config.mode == PrintMode.TEXT_ONLY:
-                # Init position for printing of photos is top-left but for text it's bottom-left
-                # Get one row upper. This little hack is needed as TextBlock is hardcoded and not computed using CardSpacing + Content Spacing
-                yDelim -= (CardSpacing.rowDelta * 0.5)
+profiler = None
+
+def worker_task(fn):
+    """Task for a worker process, returns the metrics measured in it with the result, profiled with --profile"""
+    task = partial(metrics.measured, fn)
+    return profiler.task(task) if profiler else task
+
+def init_worker(config):
+    Config.load(config)
+    setup_logging()
+    if profiler:
+        # A forked worker inherits the running main profiler, on Python 3.12+ it would block its own
+        profiler.detach()
+
+def get_detector():
+    # OpenCV and NumPy are loaded only when faces are really detected, on the first photo missing
+    # in the cache. The model is loaded once per process then.
+    from facedetector import FaceDetector
+
+    return FaceDetector.get(Config.detectormodel, Config.detectsize, Config.scalefactor, Config.detector)
+
+photocache = None
+
+def get_cache():
+    """Photo cache with the fingerprint of current settings, set up once per process"""
+    global photocache
+
+    if not Config.cache or Config.interactive or not needs_photos():
+        return None, None
+
+    if photocache is None:
+        settings = {
+            'crop': Config.crop,
+            'equalizehist': Config.equalizehist,
+            'dpi': Config.dpi,
+            'jpegquality': Config.jpegquality,
+        }
+        if needs_processing():
+            settings.update({
+                'detector': Config.detector,
+                'model': PhotoCache.hash_file(Config.detectormodel),
+                'detectsize': Config.detectsize,
+                'scalefactor': Config.scalefactor,
+                'minneighbors': DetectorSettings.minNeighbors.get(Config.detector),
+                'confidence': DetectorSettings.dnnConfidence if Config.detector == DetectorType.DNN else None,
+                'minfacesize': DetectorSettings.minFaceSize,
+            })
+        photocache = PhotoCache(Config.cachedir, Config.cachesize * 2**20), PhotoCache.fingerprint(settings)
+
+    return photocache
+
+def process_photo(imgpath):
+    cache, fingerprint = get_cache()
+    if cache:
+        key = cache.key(imgpath, fingerprint)
+        data = cache.get(key)
+        if data is not None:
+            metrics.count('cache_hits')
+            return data
+
+    data = process_photo_uncached(imgpath)
+
+    if cache:
+        cache.put(key, data)
+
+    return data
+
+def process_photo_uncached(imgpath):
+    if needs_processing():
+        img = get_detector().process(imgpath)
+    else:
+        import cv2
+
+        with metrics.stage('imread'):
+            img = cv2.imread(imgpath)
+        if img is None:
+            raise IOError(f"Could not read image '{imgpath}'!")
+
+    return encode_photo(img)
+
+def encode_photo(img):
+    with metrics.stage('encode'):
+        if Config.dpi > 0:
+            img = PDFPrinter.fit_dpi(img, Config.dpi)
+
+        # Encoded already here, so only the JPEG data travels between processes
+        return PDFPrinter.encode(img, Config.jpegquality)
+
+def prepare_review(imgpath):
+    """Variants of the photo offered in interactive mode, encoded for printing, and their previews"""
+    from facedetector import FaceDetector
+
+    variants, rects = get_detector().variants(FaceDetector.imread(imgpath))
+    return [encode_photo(vis) for vis in variants], FaceDetector.previews(variants, rects)
+
+def submit_ahead(executor, fn, items, ahead):
+    """Submit fn for the items to the executor and yield the futures in the same order.
+
+    Only `ahead` items are in flight besides the yielded one, so the workers cannot get
+    too far ahead of the consumer. None items are not submitted, None is yielded for them.
+    """
+    pending = deque()
+    items = iter(items)
+
+    def submit():
+        for item in items:
+            pending.append(executor.submit(fn, item) if item is not None else None)
+            return
+
+    for _ in range(ahead):
+        submit()
+
+    while pending:
+        future = pending.popleft()
+        submit()
+        yield future
+
+def process_photos(imgpaths):
+    """Yield (encoded image, exception, metrics snapshot) for each path in the same order as the paths.
+
+    With more jobs, the face detection runs in a process pool. Only a bounded window
+    of photos is in flight, so the workers cannot get too far ahead of the PDF writer.
+    Metrics of each photo are returned, not merged, so the caller can assign them to the person.
+    """
+    # Nothing to process (or review) when photos are embedded as they are or not printed at all
+    if not needs_reencoding() or not needs_photos():
+        for _ in imgpaths:
+            yield None, None, None
+        return
+
+    if Config.interactive:
+        yield from review_photos(imgpaths)
+        return
+
+    if Config.jobs <= 1:
+        for imgpath in imgpaths:
+            if imgpath is None:
+                yield None, None, None
+                continue
+            try:
+                data, snapshot = metrics.measured(process_photo, imgpath)
+            except Exception as e:
+                yield None, e, None
+                continue
+            yield data, None, snapshot
+        return
+
+    with ProcessPoolExecutor(max_workers=Config.jobs, initializer=init_worker, initargs=(Config.dump(),)) as executor:
+        for future in submit_ahead(executor, worker_task(process_photo), imgpaths, Config.jobs * 4):
+            if future is None:
+                yield None, None, None
+                continue
+            try:
+                data, snapshot = future.result()
+            except Exception as e:
+                yield None, e, None
+                continue
+            yield data, None, snapshot
+
+def review_photos(imgpaths):
+    """Interactive counterpart of process_photos, the operator chooses a variant of each photo.
+
+    Variants of the next Config.prefetch photos are prepared in worker processes
+    while the operator reviews the current one. Called only when some output prints photos,
+    OpenCV and NumPy are not loaded otherwise.
+    """
+    from facedetector import FaceDetector
+
+    with ProcessPoolExecutor(max_workers=Config.jobs, initializer=init_worker, initargs=(Config.dump(),)) as executor:
+        for future in submit_ahead(executor, worker_task(prepare_review), imgpaths, Config.prefetch):
+            if future is None:
+                yield None, None, None
+                continue
+            try:
+                (variants, previews), snapshot = future.result()
+                yield variants[FaceDetector.review(previews)], None, snapshot
+            except Exception as e:
+                yield None, e, None
+
+def print_card(pp, mode, pi, photo, slot):
+    with metrics.stage('embed'):
+        # Print photo, if needed
+        if mode != PrintMode.TEXT_ONLY and photo is not None:
+            try:
+                pp.set_coordintates(slot.x, slot.y)
+                pp.print_photo(photo, pi)
+            except Exception as e:
+                logger.error(f"!!! Could not print the image!\n{str(e)}")
+
+        # Print person info, if needed
+        if mode != PrintMode.PHOTO_ONLY:
+            pp.set_coordintates(slot.xText, slot.yText)
+            pp.print_person_info(pi)
+
+        # Print person delimiter (for easier cutting of prints)
+        pp.print_delimiter(slot.xDelim, slot.yDelim, DelimiterStyle.FRAME)
+
+def render_fragment(path, mode, spacing, cards):
+    """Render cards [(person, photo, slot)] of consecutive pages into a separate PDF file"""
+    pp = PDFPrinter(path, spacing)
+
+    page = cards[0][2].page if cards else 0
+    for pi, photo, slot in cards:
+        if slot.page != page:
+            page = slot.page
+            pp.add_page()
+        print_card(pp, mode, pi, photo, slot)
+
+    with metrics.stage('output'):
+        pp.output()
+    return path
+
+class Output:
+    """One PDF file with cards printed in a mode, placed to slots precomputed by its LayoutEngine.
+
+    With Config.sheetsperfile set, the output is split into numbered chunks of that many sheets,
+    each chunk is written (and freed from memory) as soon as it is full.
+
+    With a renderer (process pool), pages are not printed here. Cards are collected into
+    fragments of consecutive sheets, each fragment is rendered in a worker process and
+    the fragments are merged in order at the end. Chunks are used as fragments if set.
+    """
+    FRAGMENT_SHEETS = 5
+
+    def __init__(self, mode, count, renderer = None):
+        self.mode = mode
+        self.layout = LayoutEngine(mode, Config.direction, Config.fill)
+        self.slots = self.layout.slots(count)
+        self.spacing = self.layout.spacing
+        self.path = Config.output_path(mode)
+        self.chunks = []
+        self.cards = 0      # Cards printed so far
+        self.page = 0       # Page of the last printed card
+        self.sheets = 0     # Sheets in the current file
+
+        self.renderer = renderer
+        if renderer:
+            self.pp = None
+            self.sheets = 1
+            self.fragment = []      # Cards of the fragment being collected
+            self.fragments = []     # Futures of submitted fragments
+        else:
+            self.pp = self.new_printer()
+
+    def next_path(self):
+        root, ext = os.path.splitext(self.path)
+        if Config.sheetsperfile:
+            path = f"{root}-{len(self.chunks) + 1:03}{ext}"
+        else:
+            path = f"{root}.part-{len(self.chunks) + 1:03}{ext}"
+        self.chunks.append(path)
+        return path
+
+    def new_printer(self):
+        path = self.next_path() if Config.sheetsperfile else self.path
+        self.sheets = 1
+        return PDFPrinter(path, self.spacing)
+
+    def next_slot(self):
+        slot = self.slots[self.cards]
+        self.cards += 1
+
+        if slot.page != self.page:
+            self.page = slot.page
+
+            if self.renderer:
+                if self.sheets >= (Config.sheetsperfile or Output.FRAGMENT_SHEETS):
+                    self.submit_fragment()
+                self.sheets += 1
+            elif Config.sheetsperfile and self.sheets >= Config.sheetsperfile:
+                logger.info(f"Chunk '{self.pp.path}' is full, writing it.")
+                with metrics.stage('output'):
+                    self.pp.output()
+                self.pp = self.new_printer()
             else:
-                # In other modes, move back just part of the spacing (cannot by half because of country printed below the photo)
-                yDelim -= (Config.spacing.ySpacing * 0.2)
+                logger.debug("Height limit reached. Adding a new page to '%s'.", self.pp.path)
+                self.sheets += 1
+                self.pp.add_page()
+
+        return slot
+
+    def submit_fragment(self):
+        if self.fragment:
+            self.fragments.append(self.renderer.submit(worker_task(render_fragment), self.next_path(), self.mode, self.spacing, self.fragment))
+        self.fragment = []
+        self.sheets = 0
+
+    def print_card(self, pi, photo):
+        slot = self.next_slot()
+
+        if self.renderer:
+            self.fragment.append((pi, photo, slot))
+        else:
+            print_card(self.pp, self.mode, pi, photo, slot)
+
+    def output(self):
+        if self.renderer:
+            self.submit_fragment()
+            if not self.fragments:
+                # Nothing to print, write at least an empty file
+                self.fragments.append(self.renderer.submit(worker_task(render_fragment), self.next_path(), self.mode, self.spacing, []))
+            for fragment in self.fragments:
+                path, snapshot = fragment.result()
+                metrics.merge(snapshot)
+                logger.debug("Fragment '%s' rendered.", path)
+        else:
+            with metrics.stage('output'):
+                self.pp.output()
+
+        # Fragments of parallel rendering are always merged, chunks on request
+        if self.chunks and (Config.mergechunks or not Config.sheetsperfile):
+            logger.info(f"Merging {len(self.chunks)} files into '{self.path}'.")
+            with metrics.stage('merge'):
+                PDFPrinter.merge(self.chunks, self.path)
+
+            for chunk in self.chunks:
+                os.remove(chunk)
+
+    def discard(self):
+        """Remove the numbered files written so far, after a failure"""
+        for chunk in self.chunks:
+            try:
+                os.remove(chunk)
+            except FileNotFoundError:
+                pass
+
+def needs_photos():
+    return any(mode != PrintMode.TEXT_ONLY for mode in Config.modes)
+
+def do():
+    start = time.perf_counter()
+
+    # Whole file is validated before any PDF work starts
+    with metrics.stage('ingest'):
+        people = load_people(Config.peoplecsv)
 
-            pp.print_delimiter(xDelim, yDelim, DelimiterStyle.FRAME)
+    if needs_photos() and needs_processing():
+        check_detector()
+    if Config.parallelrender or Config.mergechunks:
+        check_merging()
 
-            # Compute new coordinates
-            x += xIncrement
-            # Check for need to increment/decrement row
-            if x < xLeftLimit or x > xRightLimit:
-                x = xInit
-                y += yIncrement
+    # Pages can be rendered by worker processes
+    renderer = None
+    if Config.parallelrender:
+        # Workers forked from here start with parsed fonts instead of all parsing them at once
+        PDFPrinter.load_fonts()
+        renderer = ProcessPoolExecutor(max_workers=Config.jobs, initializer=init_worker, initargs=(Config.dump(),))
 
-            # Check if a new page should be added
-            if y < yTopLimit or y > yBottomLimit:
-                logger.debug(f"Height limit reached. Adding a new page.")
-                y = yInit
-                pp.add_page()
+    # All outputs are generated in one pass, each person is processed only once
+    outputs = [Output(mode, len(people), renderer) for mode in Config.modes]
+
+    try:
+        cache, _ = get_cache()
+        if cache and Config.clearcache:
+            cache.clear()
+        index = build_index() if needs_photos() else None
+
+        # For debug message only.
+        i = 0
+        rows = len(people)
 
-    pp.output()
-    cv2.destroyAllWindows()
+        # Find all photos first, so they can be processed ahead of the PDF writer
+        if needs_photos():
+            lookups = [metrics.measured(find_photo, index, pi) for pi in people]
+        else:
+            lookups = [(None, None)] * len(people)
+        imgpaths = [imgpath for imgpath, _ in lookups]
+
+        # Sizes of source photos and of the embedded ones, to report savings
+        srcsize = embedsize = 0
+        # Metrics of each person for the --metrics-json file
+        records = []
+
+        for pi, (imgpath, lookup), (vis, error, processing) in zip(people, lookups, process_photos(imgpaths)):
+            i += 1
+
+            logger.info("Exporting (%d/%d) %s", i, rows, pi.name)
+
+            with metrics.collecting() as m:
+                for snapshot in (lookup, processing):
+                    if snapshot:
+                        metrics.merge(snapshot)
+
+                record = {'name': pi.name, 'photo': imgpath, 'status': 'ok'}
+                records.append(record)
+
+                photo = None
+                if imgpath is not None and error is not None and not needs_processing():
+                    # Only the downsampling failed, the photo is embedded as it is, same as with --dpi 0
+                    logger.warning(f"Could not downsample the photo, embedding it as it is: {str(error)}")
+                    metrics.count('not_downsampled')
+                    error = None
+
+                if imgpath is not None and error is not None:
+                    # Skipped in all outputs, so photos and texts printed separately still match
+                    logger.error(f"!!! Processing of the photo thrown an Exception!\n{str(error)}")
+                    logger.warning(f"Skipping the person completely...")
+                    metrics.count('skipped')
+                    record['status'] = 'skipped'
+                else:
+                    if imgpath is not None:
+                        photo = vis if vis is not None else imgpath
+
+                        srcsize += os.path.getsize(imgpath)
+                        embedsize += len(vis) if vis is not None else os.path.getsize(imgpath)
+                    elif needs_photos():
+                        record['status'] = 'missing photo'
+
+                    for output in outputs:
+                        output.print_card(pi, photo)
+
+            record['stages'] = {name: round(m.times[name], 6) for name in m.stages()}
+            record['counters'] = dict(m.counters)
+
+        for output in outputs:
+            output.output()
+    except BaseException:
+        if renderer:
+            # A part of the output is missing, do not leave the rendered fragments behind
+            renderer.shutdown(cancel_futures=True)
+            for output in outputs:
+                output.discard()
+        raise
+    finally:
+        if renderer:
+            renderer.shutdown()
+
+    if cache:
+        cache.evict()
+
+    if srcsize:
+        # Only the photo payloads are compared, the PDF files themselves are not measured
+        logger.info(f"Embedded photo data take {embedsize / 2**20:.1f} MiB instead of {srcsize / 2**20:.1f} MiB of source photos "
+                    f"(photo payload {(srcsize - embedsize) / 2**20:.1f} MiB smaller per output).")
+
+    wall = time.perf_counter() - start
+    logger.info(f"Time spent in processing stages:\n{metrics.totals().summary(wall)}")
+    if Config.metricsjson:
+        metrics.totals().save(Config.metricsjson, wall=round(wall, 6), people=records)
+        logger.info(f"Metrics written to '{Config.metricsjson}'.")
 
 def main():
+    global profiler
+
     parse_args()
-    logger.debug(Config.info())
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(Config.info())
 
     #imagelist = load_images()
 
-    do()
+    try:
+        if Config.profile:
+            profiler = Profiler(Config.profile, Config.profiletop)
+            profiler.run(do)
+        else:
+            do()
+    except CSVValidationError as e:
+        logger.error(f"!!! {e}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,114 @@
+from collections import namedtuple
+from collections.abc import Sequence
+
+from config import CardSpacing, ContentSpacing, FillOrder, PrintDirection, PrintMode
+
+# Position of one card. (x, y) is the init position of the card (top-left corner of the photo),
+# (xText, yText) of its text block and (xDelim, yDelim) of its cutting delimiter.
+Slot = namedtuple('Slot', ['page', 'x', 'y', 'xText', 'yText', 'xDelim', 'yDelim'])
+
+
+class LayoutEngine:
+    """Computes positions of all cards on the pages without printing anything.
+
+    Cards are placed on a grid given by ContentSpacing. The grid starts in the top-left
+    corner for PrintDirection.NORMAL and in the bottom-right corner for PrintDirection.REVERSED,
+    and it is filled row by row or column by column.
+    """
+
+    def __init__(self, mode, direction, fill = FillOrder.ROWS):
+        self.mode = mode
+        self.direction = direction
+        self.fill = fill
+        self.spacing = ContentSpacing(mode, direction)
+
+        sp = self.spacing
+        xStep = abs(sp.xIncrement)
+        yStep = abs(sp.yIncrement)
+
+        # Small epsilon against floating point errors of the limits
+        self.cols = max(int((sp.xRightLimit - sp.xLeftLimit) / xStep + 1e-9) + 1, 1)
+        self.rows = max(int((sp.yBottomLimit - sp.yTopLimit) / yStep + 1e-9) + 1, 1)
+        self.perPage = self.cols * self.rows
+
+        if direction == PrintDirection.NORMAL:
+            self.xs = [sp.xLeftLimit + c * xStep for c in range(self.cols)]
+            self.ys = [sp.yTopLimit + r * yStep for r in range(self.rows)]
+        else:
+            self.xs = [sp.xRightLimit - c * xStep for c in range(self.cols)]
+            self.ys = [sp.yBottomLimit - r * yStep for r in range(self.rows)]
+
+        # Offsets of the text block and the delimiter, the same for all cards
+        if mode == PrintMode.TEXT_ONLY:
+            self.textOffset = (0, 0)
+            # Init position for printing of photos is top-left but for text it's bottom-left
+            # Get one row upper. This little hack is needed as TextBlock is hardcoded and not computed using CardSpacing + Content Spacing
+            yDelim = -(CardSpacing.rowDelta * 0.5)
+        else:
+            # If we print both photo and text, move init position of text next to the photo
+            self.textOffset = (CardSpacing.textDelta, CardSpacing.rowDelta)
+            # In other modes, move back just part of the spacing (cannot by half because of country printed below the photo)
+            yDelim = -(sp.ySpacing * 0.2)
+
+        self.delimOffset = (-(sp.xSpacing / 2.0), yDelim) # get between cols
+
+        # All pages look the same, positions are computed for one page only
+        self.positions = [self.position(i) for i in range(self.perPage)]
+
+    def position(self, i):
+        """Position of i-th card on a page as (x, y, xText, yText, xDelim, yDelim)"""
+        if self.fill == FillOrder.ROWS:
+            r, c = divmod(i, self.cols)
+        else:
+            c, r = divmod(i, self.rows)
+
+        x, y = self.xs[c], self.ys[r]
+        return (x, y,
+                x + self.textOffset[0], y + self.textOffset[1],
+                x + self.delimOffset[0], y + self.delimOffset[1])
+
+    def slot(self, i):
+        page, i = divmod(i, self.perPage)
+        return Slot(page, *self.positions[i])
+
+    def slots(self, count):
+        """Positions of `count` cards, computed when accessed"""
+        return Slots(self, count)
+
+    def pages(self, count):
+        """Number of pages needed for `count` cards"""
+        return -(-count // self.perPage)
+
+
+class Slots(Sequence):
+    """Slots of consecutive cards.
+
+    Only the positions of one page are precomputed by LayoutEngine, a slot is made when
+    it is accessed. A list of all slots built up front was slower than the slot walk it
+    replaced, nearly all of its time went to creating the slot tuples.
+    """
+
+    def __init__(self, layout, count):
+        self.layout = layout
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.layout.slot(j) for j in range(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("slot index out of range")
+        return self.layout.slot(i)
+
+    def __iter__(self):
+        positions = self.layout.positions
+        full, rest = divmod(self.count, self.layout.perPage)
+        for page in range(full):
+            for pos in positions:
+                yield Slot(page, *pos)
+        for pos in positions[:rest]:
+            yield Slot(full, *pos)
@@ -0,0 +1,123 @@
+import json
+import logging
+import time
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Stages in the order they run, the per person ones from lookup to embed
+STAGES = ('ingest', 'lookup', 'imread', 'detect', 'crop', 'equalize', 'encode', 'embed', 'output', 'merge')
+
+
+class Metrics:
+    """Time spent in processing stages and counters of events (faces found, skipped people, ...).
+
+    Metrics collected in worker processes are passed back as a snapshot() and merged.
+    """
+
+    def __init__(self):
+        self.times = defaultdict(float)     # stage -> seconds
+        self.calls = Counter()              # stage -> number of runs
+        self.counters = Counter()
+
+    def add(self, name, seconds):
+        self.times[name] += seconds
+        self.calls[name] += 1
+
+    def snapshot(self):
+        return {'times': dict(self.times), 'calls': dict(self.calls), 'counters': dict(self.counters)}
+
+    def merge(self, snapshot):
+        for name, seconds in snapshot['times'].items():
+            self.times[name] += seconds
+        self.calls.update(snapshot['calls'])
+        self.counters.update(snapshot['counters'])
+
+    def stages(self):
+        """Known stages first, then any other measured ones"""
+        return [s for s in STAGES if s in self.times] + sorted(s for s in self.times if s not in STAGES)
+
+    def summary(self, wall = None):
+        total = sum(self.times.values())
+        lines = [f"{'stage':10} {'runs':>7} {'total [s]':>10} {'mean [ms]':>10} {'share':>6}"]
+        for name in self.stages():
+            seconds = self.times[name]
+            lines.append(f"{name:10} {self.calls[name]:7} {seconds:10.3f} {seconds / self.calls[name] * 1000:10.1f} "
+                         f"{seconds / total if total else 0:6.1%}")
+        lines.append(f"{'total':10} {'':7} {total:10.3f}  (summed over all processes)")
+        if wall is not None:
+            lines.append(f"{'wall':10} {'':7} {wall:10.3f}")
+        if self.counters:
+            lines.append(", ".join(f"{name}: {n}" for name, n in sorted(self.counters.items())))
+        return "\n".join(lines)
+
+    def save(self, path, **extra):
+        data = {
+            **extra,
+            'stages': {name: {'runs': self.calls[name], 'seconds': round(self.times[name], 6)} for name in self.stages()},
+            'counters': dict(sorted(self.counters.items())),
+        }
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, default=str)
+        except OSError as e:
+            logger.error(f"!!! Could not write metrics to '{path}': {e}")
+
+
+# Metrics being collected, run totals at the bottom. Measured values go to all of them.
+_active = [Metrics()]
+
+
+def totals():
+    return _active[0]
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        for m in _active:
+            m.add(name, elapsed)
+
+
+def count(name, n = 1):
+    for m in _active:
+        m.counters[name] += n
+
+
+def merge(snapshot):
+    """Add metrics collected elsewhere (e.g. in a worker process)"""
+    for m in _active:
+        m.merge(snapshot)
+
+
+@contextmanager
+def collecting(isolated = False):
+    """Collect metrics measured in the block also into a new Metrics.
+
+    Isolated metrics are not added to the enclosing ones, they are merged later by the caller.
+    """
+    global _active
+
+    m = Metrics()
+    outer = _active
+    _active = [m] if isolated else outer + [m]
+    try:
+        yield m
+    finally:
+        _active = outer
+
+
+def measured(fn, *args):
+    """Call fn and return its result with a snapshot of metrics measured in it.
+
+    Used for tasks of worker processes, their metrics would be lost otherwise.
+    """
+    with collecting(isolated=True) as m:
+        result = fn(*args)
+    return result, m.snapshot()
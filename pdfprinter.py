@@ -1,10 +1,21 @@
+import hashlib
 import os
+import pickle
+import struct
+import tempfile
 from enum import Enum
+from io import BytesIO
 from fpdf import FPDF, set_global
 
 from config import PhotoSize, TextDeltas, CardSpacing, Config
 
-set_global("SYSTEM_TTFONTS", os.path.join(os.path.dirname(__file__), 'fonts'))
+FONTS_DIR = os.path.join(os.path.dirname(__file__), 'fonts')
+FONT_CACHE_DIR = os.path.join(FONTS_DIR, 'cache')
+
+set_global("SYSTEM_TTFONTS", FONTS_DIR)
+
+# JPEG start of frame markers, SOF0 - SOF15 except DHT (C4), JPG (C8) and DAC (CC)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
 
 
 class DelimiterStyle(Enum):
@@ -15,34 +26,207 @@ class DelimiterStyle(Enum):
         return self.value
 
 
+class MemoryFPDF(FPDF):
+    """FPDF which can also embed encoded images held in memory instead of files"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.memimages = {}
+
+    def add_memory_image(self, data):
+        """Register encoded JPEG image and return (name, type) to be passed to image()"""
+        if data[:2] != b'\xff\xd8':
+            raise TypeError("Only JPEG images can be embedded from memory!")
+
+        name = f"memory://{len(self.images) + len(self.memimages)}.jpg"
+        self.memimages[name] = data
+        return name, 'jpg'
+
+    def _parsejpg(self, filename):
+        if filename not in self.memimages:
+            return super()._parsejpg(filename)
+
+        # Same as in FPDF, which can only open files: find the frame header (SOF) for the size and colors
+        data = self.memimages.pop(filename)
+        f = BytesIO(data)
+        try:
+            while True:
+                marker, kind = struct.unpack('BB', f.read(2))
+                if marker != 0xFF or kind < 0xC0 or kind == 0xDA:
+                    raise ValueError("no frame header found")
+                if kind == 0xC8 or 0xD0 <= kind <= 0xD9 or 0xF0 <= kind <= 0xFD:
+                    # Markers without a segment
+                    continue
+                size, = struct.unpack('>H', f.read(2))
+                segment = f.read(size - 2)
+                if kind in SOF_MARKERS:
+                    bpc, height, width, layers = struct.unpack_from('>BHHB', segment)
+                    break
+        except (struct.error, ValueError) as e:
+            self.error(f"Incorrect image in memory: {filename}, {e}")
+
+        colorspace = {3: 'DeviceRGB', 4: 'DeviceCMYK'}.get(layers, 'DeviceGray')
+        # Image is parsed only once, the data are kept by FPDF from now on
+        return {'w': width, 'h': height, 'cs': colorspace, 'bpc': bpc, 'f': 'DCTDecode', 'data': data}
+
+
+class FontCache:
+    """Parsed TrueType fonts, shared by all PDFPrinter instances in the process.
+
+    On disk, the parsed metrics are kept in FONT_CACHE_DIR in a folder named by
+    the font file hash, so a changed font file gets parsed again. The file is written
+    here rather than by fpdf, atomically, as more worker processes can parse the same font at once.
+    """
+    fonts = {}  # fontkey -> (font, font files)
+
+    @staticmethod
+    def cache_dir(ttfpath):
+        h = hashlib.sha256()
+        with open(ttfpath, 'rb') as f:
+            h.update(f.read())
+        return os.path.join(FONT_CACHE_DIR, h.hexdigest())
+
+    @staticmethod
+    def load(path):
+        """(font, font files) stored in the cache file, None if missing or unreadable"""
+        try:
+            with open(path, 'rb') as f:
+                font, files = pickle.load(f)
+        except Exception:
+            return None
+
+        # The cache may have been created in another checkout
+        if not os.path.exists(font['ttffile']):
+            return None
+        return font, files
+
+    @staticmethod
+    def save(path, entry):
+        fh, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fh, 'wb') as f:
+                pickle.dump(entry, f)
+            os.replace(tmppath, path)
+        except OSError:
+            # Parsed again next time
+            try:
+                os.remove(tmppath)
+            except OSError:
+                pass
+
+    @staticmethod
+    def add_font(pdf, family, style, fname):
+        fontkey = family.lower() + style
+
+        if fontkey not in FontCache.fonts:
+            cachedir = FontCache.cache_dir(os.path.join(FONTS_DIR, fname))
+            path = os.path.join(cachedir, 'metrics.pkl')
+
+            entry = FontCache.load(path)
+            if entry is None:
+                # Parse without fpdf's own cache files, which are written non-atomically
+                set_global("FPDF_CACHE_MODE", 1)
+                files = set(pdf.font_files)
+                pdf.add_font(family, style=style, fname=fname, uni=True)
+
+                # Keep a pristine copy, fpdf adds object numbers and used characters to its own.
+                # Only the dicts and the subset list are copied, the metrics (cw, desc) are shared read-only.
+                entry = (dict(pdf.fonts[fontkey], subset=list(pdf.fonts[fontkey]['subset'])),
+                         {k: dict(v) for k, v in pdf.font_files.items() if k not in files})
+
+                os.makedirs(cachedir, exist_ok=True)
+                FontCache.save(path, entry)
+                FontCache.fonts[fontkey] = entry
+                return
+
+            FontCache.fonts[fontkey] = entry
+
+        font, files = FontCache.fonts[fontkey]
+        # Metrics are read-only and can be shared, the character subset is per document
+        pdf.fonts[fontkey] = dict(font, i=len(pdf.fonts) + 1, subset=list(font['subset']))
+        pdf.font_files.update({k: dict(v) for k, v in files.items()})
+
+
 class PDFPrinter:
     xCurrent = 0
     yCurrent = 0
 
-    def __init__(self, path):
+    FONT_FAMILY = "NotoSans"
+    FONTS = {
+        "": "NotoSans-Regular.ttf",
+        "B": "NotoSans-Bold.ttf",
+        "I": "NotoSans-Italic.ttf",
+        "BI": "NotoSans-BoldItalic.ttf",
+    }
+
+    def __init__(self, path, spacing = None):
         self.path = path
+        self.spacing = spacing or Config.spacing
 
-        self.pdf = FPDF('P', 'mm', 'A4')
+        self.pdf = MemoryFPDF('P', 'mm', 'A4')
         self.page_setup()
 
+    @staticmethod
+    def load_fonts():
+        """Parse the fonts into FontCache, e.g. before worker processes are forked"""
+        PDFPrinter(None)
+
+    @staticmethod
+    def fit_dpi(img, dpi):
+        """Downsample an image to the pixel size of the printed photo at given DPI"""
+        import cv2
+
+        w = round(PhotoSize.w / 25.4 * dpi)
+        h = round(PhotoSize.h / 25.4 * dpi)
+
+        # Never upscale, it would only make the PDF bigger
+        if img.shape[0] * img.shape[1] <= w * h:
+            return img
+
+        return cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def encode(img, quality = None):
+        """Encode an image (numpy array in BGR) to JPEG bytes which can be embedded, with --jpeg-quality by default"""
+        import cv2
+
+        if quality is None:
+            quality = Config.jpegquality
+
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError("Could not encode the image!")
+        return buf.tobytes()
+
     def page_setup(self):
-        self.pdf.add_font("NotoSans", style="", fname="NotoSans-Regular.ttf", uni=True)
-        self.pdf.add_font("NotoSans", style="B", fname="NotoSans-Bold.ttf", uni=True)
-        self.pdf.add_font("NotoSans", style="I", fname="NotoSans-Italic.ttf", uni=True)
-        self.pdf.add_font("NotoSans", style="BI", fname="NotoSans-BoldItalic.ttf", uni=True)
-        self.pdf.set_font("NotoSans", size=8)
+        self.set_font("", 8)
 
         self.pdf.add_page()
 
+    def set_font(self, style, size):
+        """Set font style, the style is loaded when used for the first time"""
+        fontkey = PDFPrinter.FONT_FAMILY.lower() + style
+        if fontkey not in self.pdf.fonts:
+            FontCache.add_font(self.pdf, PDFPrinter.FONT_FAMILY, style, PDFPrinter.FONTS[style])
+
+        self.pdf.set_font(PDFPrinter.FONT_FAMILY, style=style, size=size)
+
     def set_coordintates(self, x, y):
         self.xCurrent = x
         self.yCurrent = y
 
     def print_photo(self, img, pi):
+        """Print photo given as a file path, encoded JPEG bytes or numpy array"""
         x = self.xCurrent
         y = self.yCurrent
 
-        self.pdf.image(img, x, y, PhotoSize.w, PhotoSize.h)
+        if isinstance(img, str):
+            self.pdf.image(img, x, y, PhotoSize.w, PhotoSize.h)
+        else:
+            if not isinstance(img, (bytes, bytearray)):
+                img = PDFPrinter.encode(img)
+            name, imgtype = self.pdf.add_memory_image(bytes(img))
+            self.pdf.image(name, x, y, PhotoSize.w, PhotoSize.h, type=imgtype)
 
         # Write name below the image
         xText = x
@@ -83,11 +267,11 @@ class PDFPrinter:
                       pi.validity.strftime("%y"))  # year
 
     def __print_cross(self, x, y):
-        delimX1 = x - Config.spacing.xSpacing / 3.0
-        delimX2 = x + Config.spacing.xSpacing / 3.0
+        delimX1 = x - self.spacing.xSpacing / 3.0
+        delimX2 = x + self.spacing.xSpacing / 3.0
 
-        delimY1 = y - Config.spacing.ySpacing / 3.0
-        delimY2 = y + Config.spacing.ySpacing / 3.0
+        delimY1 = y - self.spacing.ySpacing / 3.0
+        delimY2 = y + self.spacing.ySpacing / 3.0
 
         self.pdf.line(delimX1, y, delimX2, y)
         self.pdf.line(x, delimY1, x, delimY2)
@@ -95,8 +279,8 @@ class PDFPrinter:
     def __print_frame(self, x, y):
         """ We rely on coordinates being top-left. Disgusting, I know..."""
         # Add abs() value so it always goes down-right direction no matter what printing direction is set
-        delimX1 = x + abs(Config.spacing.xIncrement)
-        delimY1 = y + abs(Config.spacing.yIncrement)
+        delimX1 = x + abs(self.spacing.xIncrement)
+        delimY1 = y + abs(self.spacing.yIncrement)
 
         self.pdf.dashed_line(delimX1, y, x, y)
         self.pdf.dashed_line(x, delimY1, x, y)
@@ -113,5 +297,18 @@ class PDFPrinter:
     def output(self):
         self.pdf.output(self.path, "F")
 
+    @staticmethod
+    def merge(paths, path):
+        """Concatenate PDF files into one, in the given order"""
+        # Optional dependency, needed only for merging
+        from pypdf import PdfWriter
+
+        writer = PdfWriter()
+        for p in paths:
+            writer.append(p)
+
+        with open(path, "wb") as f:
+            writer.write(f)
+
     def add_page(self):
         self.pdf.add_page()
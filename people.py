@@ -0,0 +1,116 @@
+import csv
+import logging
+
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+
+class CSVValidationError(ValueError):
+    """The CSV file with students contains rows which cannot be used"""
+
+    def __init__(self, path, errors):
+        self.path = path
+        self.errors = errors    # [(line number, message)]
+        super().__init__(f"{len(errors)} invalid row(s) in '{path}':\n" +
+                         "\n".join(f"  line {line}: {message}" for line, message in errors))
+
+
+class PersonInfo:
+    __slots__ = ('name', 'nationality', 'birthday', 'faculty', 'section', 'validity', 'before_arrival')
+
+    FACULTY = "VUT Brno"
+    SECTION = "ESN VUT Brno"
+
+    # Columns exported by download_images.py
+    COLUMNS = ('name', 'country', 'D0', 'D1', 'M0', 'M1', 'Y0', 'Y1',
+               'TD0', 'TD1', 'TM0', 'TM1', 'TY0', 'TY1', 'before_arrival')
+
+    def __init__(self, name, nationality, birthday, validity, before_arrival=""):
+        self.name = name
+        self.nationality = nationality
+        self.birthday = birthday
+        self.validity = validity
+        self.before_arrival = before_arrival
+        self.faculty = PersonInfo.FACULTY
+        self.section = PersonInfo.SECTION
+
+    @staticmethod
+    def parse_date(row, prefix, past):
+        """Parse date split into digits, e.g. D0,D1,M0,M1,Y0,Y1.
+
+        download_images.py exports only the last two digits of the year. Dates in the past
+        (birthdays) belong to the last hundred years, other dates to this century.
+        """
+        digits = [row[prefix + c] for c in ('D0', 'D1', 'M0', 'M1', 'Y0', 'Y1')]
+        if not all(len(d) == 1 and d.isdigit() for d in digits):
+            raise ValueError(f"date '{''.join(digits)}' in columns {prefix}D0..{prefix}Y1 is not made of six digits")
+
+        day = int(digits[0] + digits[1])
+        month = int(digits[2] + digits[3])
+        year = 2000 + int(digits[4] + digits[5])
+        if past and year > date.today().year:
+            year -= 100
+
+        try:
+            return date(year, month, day)
+        except ValueError as e:
+            raise ValueError(f"date {day:02}.{month:02}.{year} is not valid ({e})")
+
+    @staticmethod
+    def from_row(row):
+        name = (row['name'] or '').strip()
+        nationality = (row['country'] or '').strip()
+        if not name:
+            raise ValueError("name is empty")
+        if not nationality:
+            raise ValueError("country is empty")
+
+        return PersonInfo(
+            name,
+            nationality,
+            PersonInfo.parse_date(row, '', past=True),
+            PersonInfo.parse_date(row, 'T', past=False),
+            row['before_arrival'] or ''
+        )
+
+
+def load_people(path):
+    """Read and validate all students from the CSV file in a single pass.
+
+    Raises CSVValidationError listing every invalid row, so nothing is printed from a broken file.
+    Returns the students sorted by nationality and name.
+    """
+    people = []
+    errors = []
+
+    with open(path, newline='', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+
+        missing = [c for c in PersonInfo.COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            raise CSVValidationError(path, [(1, f"missing columns: {', '.join(missing)}")])
+
+        for row in reader:
+            # Blank lines are skipped and quoted values can span more lines, so the row
+            # starts as many lines above the last line read as there are line breaks in its values
+            values = [v for v in row.values() if isinstance(v, str)] + row.get(None, [])
+            line = reader.line_num - sum(v.count('\n') for v in values)
+
+            if None in row:
+                errors.append((line, f"{len(row[None])} value(s) more than columns"))
+            elif any(row[c] is None for c in PersonInfo.COLUMNS):
+                errors.append((line, "values missing"))
+            else:
+                try:
+                    people.append(PersonInfo.from_row(row))
+                except ValueError as e:
+                    errors.append((line, str(e)))
+
+    if errors:
+        raise CSVValidationError(path, errors)
+
+    people.sort(key=lambda pi: (pi.nationality, pi.name))
+    logger.debug(f"Loaded {len(people)} students from '{path}'.")
+
+    return people
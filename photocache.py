@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoCache:
+    """Persistent cache of processed photos.
+
+    Entries are addressed by the hash of the source photo content together with
+    all settings which affect the result. Eviction is least recently used,
+    a cache hit refreshes the entry modification time.
+    """
+    VERSION = 1
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, path, maxsize):
+        self.path = path
+        self.maxsize = maxsize
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def hash_file(path):
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(PhotoCache.CHUNK_SIZE), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def fingerprint(settings):
+        """Hash of the settings which affect the processed photo"""
+        data = json.dumps({'version': PhotoCache.VERSION, **settings}, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def key(self, imgpath, fingerprint):
+        return hashlib.sha256((PhotoCache.hash_file(imgpath) + fingerprint).encode('ascii')).hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.path, key[:2], key + '.jpg')
+
+    def get(self, key):
+        entry = self.entry(key)
+        try:
+            with open(entry, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, key, data):
+        entry = self.entry(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        # Write atomically, more processes can store the same entry at once
+        fh, tmppath = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+        try:
+            with os.fdopen(fh, 'wb') as f:
+                f.write(data)
+            os.replace(tmppath, entry)
+        except OSError as e:
+            logger.warning(f"Could not store photo to cache: {e}")
+            try:
+                os.remove(tmppath)
+            except OSError:
+                pass
+
+    def entries(self):
+        for root, _, files in os.walk(self.path):
+            for fn in files:
+                if fn.endswith('.jpg'):
+                    path = os.path.join(root, fn)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits into its size limit"""
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+
+        removed = 0
+        for path, size, _ in entries:
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+
+        if removed:
+            logger.debug(f"Evicted {removed} photos from cache '{self.path}'.")
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        logger.info(f"Photo cache '{self.path}' cleared.")
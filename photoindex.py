@@ -0,0 +1,110 @@
+import bisect
+import json
+import logging
+import os
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_name(name):
+    """Normalize a person/file name for matching - case, diacritics and whitespace insensitive"""
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.casefold().split())
+
+
+class PhotoIndex:
+    """Index of photos in a directory built by a single directory scan.
+
+    Lookup goes from exact match of the normalized file stem, through prefix match,
+    to substring match. The first level with any hit wins.
+    """
+    VERSION = 1
+
+    def __init__(self, imgpath, files):
+        self.imgpath = imgpath
+        self.files = sorted(files)
+
+        self.exact = {}     # normalized stem -> [filenames]
+        self.stems = []     # sorted [(normalized stem, filename)] for prefix search
+        for fn in self.files:
+            stem = normalize_name(os.path.splitext(fn)[0])
+            self.exact.setdefault(stem, []).append(fn)
+            self.stems.append((stem, fn))
+        self.stems.sort()
+
+    @staticmethod
+    def scan(imgpath, extensions):
+        return [fn for fn in os.listdir(imgpath) if fn.lower().endswith(extensions)]
+
+    @staticmethod
+    def build(imgpath, extensions, cachepath=None):
+        """Build the index, reusing the cache file if the directory has not changed since"""
+        mtime = os.stat(imgpath).st_mtime_ns
+
+        if cachepath:
+            index = PhotoIndex.load(cachepath, imgpath, mtime)
+            if index is not None:
+                logger.debug(f"Photo index loaded from '{cachepath}' ({len(index.files)} photos).")
+                return index
+
+        index = PhotoIndex(imgpath, PhotoIndex.scan(imgpath, extensions))
+        logger.debug(f"Photo index built from '{imgpath}' ({len(index.files)} photos).")
+
+        if cachepath:
+            index.save(cachepath, mtime)
+
+        return index
+
+    @staticmethod
+    def load(cachepath, imgpath, mtime):
+        try:
+            with open(cachepath, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if (data.get('version') != PhotoIndex.VERSION
+                or data.get('imgpath') != os.path.abspath(imgpath)
+                or data.get('mtime') != mtime):
+            logger.debug(f"Photo index cache '{cachepath}' is stale.")
+            return None
+
+        return PhotoIndex(imgpath, data['files'])
+
+    def save(self, cachepath, mtime):
+        data = {
+            'version': PhotoIndex.VERSION,
+            'imgpath': os.path.abspath(self.imgpath),
+            'mtime': mtime,
+            'files': self.files,
+        }
+        try:
+            with open(cachepath, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+        except OSError as e:
+            logger.warning(f"Could not write photo index cache '{cachepath}': {e}")
+
+    def lookup(self, name):
+        """Return all photos matching the name, most specific match level only"""
+        key = normalize_name(name)
+        if not key:
+            return []
+
+        # Exact match
+        found = self.exact.get(key)
+        if found:
+            return list(found)
+
+        # Prefix match
+        found = []
+        i = bisect.bisect_left(self.stems, (key, ''))
+        while i < len(self.stems) and self.stems[i][0].startswith(key):
+            found.append(self.stems[i][1])
+            i += 1
+        if found:
+            return sorted(found)
+
+        # Substring match
+        return [fn for stem, fn in self.stems if key in stem]
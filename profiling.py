@@ -0,0 +1,156 @@
+import cProfile
+import logging
+import multiprocessing.util
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+
+from collections import Counter, defaultdict
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# Profiles of tasks run by profiled(), one per thread of the process
+_profiles = {}
+# Set when the profiler of a thread could not be enabled, to warn only once per process
+_unprofiled = False
+
+
+def dump(workdir):
+    """Write profiles of the tasks run in this process into workdir, once at its exit"""
+    for key, profile in _profiles.items():
+        profile.dump_stats(os.path.join(workdir, f"{os.getpid()}-{key}.pstats"))
+
+
+def profiled(workdir, mainpid, fn, *args):
+    """Call fn under the profiler of the current thread.
+
+    Used for tasks of worker processes and threads, which the main profiler does not see.
+    Profiles of the main process are collected by Profiler.save() directly, those of
+    worker processes are dumped into workdir when the worker exits.
+    """
+    global _unprofiled
+
+    key = threading.get_ident()
+    profile = _profiles.get(key)
+    if profile is None:
+        if os.getpid() != mainpid and not _profiles:
+            multiprocessing.util.Finalize(None, dump, args=(workdir,), exitpriority=0)
+        profile = _profiles[key] = cProfile.Profile()
+
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12+ allows only one active profiler per process. In the main process that is
+        # the main profiler, which sees the calls of all threads then. Elsewhere the task is lost.
+        if os.getpid() != mainpid and not _unprofiled:
+            _unprofiled = True
+            logger.warning(f"Could not profile tasks of worker process {os.getpid()}, another profiler is active in it.")
+        return fn(*args)
+
+    try:
+        return fn(*args)
+    finally:
+        profile.disable()
+
+
+def label(func):
+    filename, line, name = func
+    if filename == '~':
+        # Built-in function
+        return name.replace(';', ',')
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(';', ',')
+
+
+def collapsed(stats, mintime = 1e-5, maxdepth = 100):
+    """Collapsed stacks {'root;caller;function': microseconds} for flame graphs.
+
+    cProfile records only caller - callee pairs, not whole stacks. Time of a function is split
+    among the stacks leading to it in proportion to the time spent in the calls from each caller.
+    Stacks taking less than mintime seconds are left out.
+    """
+    callees = defaultdict(list)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, ct) in callers.items():
+            callees[caller].append((func, ct))
+
+    stacks = Counter()
+
+    def walk(func, path, share):
+        _, _, tt, ct, _ = stats.stats[func]
+        path = path + [func]
+        if tt * share >= mintime:
+            stacks[';'.join(map(label, path))] += round(tt * share * 1e6)
+        if len(path) >= maxdepth:
+            return
+
+        for callee, edge in callees[func]:
+            # Recursion is folded into the first occurrence
+            if callee in path:
+                continue
+            time = edge * share
+            callee_ct = stats.stats[callee][3]
+            if time >= mintime and callee_ct > 0:
+                walk(callee, path, time / callee_ct)
+
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            walk(func, [], 1.0)
+
+    return stacks
+
+
+class Profiler:
+    """cProfile of a run, including tasks run in worker processes or threads.
+
+    Tasks wrapped by task() are profiled on their own, worker processes dump their profiles
+    into a temporary folder. All are added to the profile of the main thread at the end.
+    """
+
+    def __init__(self, path, top = 20):
+        self.path = path
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.workdir = tempfile.mkdtemp(prefix='profile-')
+        self.pid = os.getpid()
+
+    def task(self, fn):
+        return partial(profiled, self.workdir, self.pid, fn)
+
+    def detach(self):
+        """Stop the profiler a forked worker process inherited, so its tasks can be profiled"""
+        if os.getpid() != self.pid:
+            self.profile.disable()
+
+    def run(self, fn, *args):
+        self.profile.enable()
+        try:
+            return fn(*args)
+        finally:
+            self.profile.disable()
+            self.save()
+
+    def save(self):
+        stats = pstats.Stats(self.profile)
+        # Threads of this process, they are left out when the main profiler saw them already
+        for profile in _profiles.values():
+            if profile.getstats():
+                stats.add(profile)
+        workers = sorted(os.path.join(self.workdir, fn) for fn in os.listdir(self.workdir))
+        if workers:
+            stats.add(*workers)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+        stats.dump_stats(self.path)
+
+        stackspath = os.path.splitext(self.path)[0] + '.collapsed'
+        with open(stackspath, 'w', encoding='utf-8') as f:
+            for stack, us in sorted(collapsed(stats).items()):
+                f.write(f"{stack} {us}\n")
+
+        logger.info(f"Profile written to '{self.path}' (with {len(workers)} worker profiles), "
+                    f"collapsed stacks for flame graphs to '{stackspath}'.")
+
+        stats.sort_stats('tottime').print_stats(self.top)
@@ -0,0 +1,213 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import download_images
+
+JPEG = b'\xff\xd8\xff\xe0' + b'\x00' * 60
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 60
+BROKEN_WEBP = b'RIFF\x24\x00\x00\x00WEBPVP8 ' + b'\x00' * 60
+
+FORM_HEADER = "Timestamp,Email,Name,Country,Date of birth,Photo,LA,Referral,Before arrival\n"
+
+
+class StandInDrive(BaseHTTPRequestHandler):
+    """Serves files by id, answering with the queued error statuses of the id first"""
+    files = {}
+    errors = {}
+    requests = []
+
+    def do_GET(self):
+        file_id = self.path.strip('/')
+        StandInDrive.requests.append((file_id, self.headers.get('Authorization')))
+
+        statuses = StandInDrive.errors.get(file_id)
+        if statuses:
+            self.send_response(statuses.pop(0))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if file_id not in StandInDrive.files:
+            self.send_error(404)
+            return
+
+        data = StandInDrive.files[file_id]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInDrive)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/{{}}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StandInDrive.files = {'jan': JPEG, 'eva': PNG}
+        StandInDrive.errors = {}
+        StandInDrive.requests = []
+
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+
+        with open('form.csv', 'w', encoding='utf-8') as f:
+            f.write(FORM_HEADER)
+            f.write("t1,jan@example.com,Jan Novak,Czech Republic,01.02.1999,https://drive.google.com/open?id=jan,x,y,yes\n")
+            f.write("t2,eva@example.com,Eva Mala,Slovakia,03.04.1998,https://drive.google.com/open?id=eva,x,y,no\n")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def download(self, *extra):
+        args = download_images.parse_args(['form.csv', 'students.csv', '--drive-url', self.url, '--retries', '3', *extra])
+        # No OAuth flow and no client_secret.json for a stand-in server
+        with mock.patch.object(download_images, 'get_credentials', side_effect=AssertionError("credentials requested")):
+            return download_images.download(args)
+
+    def test_download(self):
+        progress = self.download()
+
+        self.assertEqual((progress.done, progress.failed, progress.unknown), (2, 0, 0))
+        with open(os.path.join('pictures', 'Jan Novak.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), JPEG)
+        with open(os.path.join('pictures', 'Eva Mala.png'), 'rb') as f:
+            self.assertEqual(f.read(), PNG)
+
+        with open('students.csv', encoding='utf-8') as f:
+            lines = f.readlines()
+        self.assertEqual(lines[0], download_images.CSV_HEADER)
+        self.assertEqual(sorted(line.split(',')[0] for line in lines[1:]), ['"Eva Mala"', '"Jan Novak"'])
+
+        # Permissions follow the umask, as for files created by open()
+        for path in (os.path.join('pictures', 'Jan Novak.jpg'), 'students.csv'):
+            self.assertEqual(os.stat(path).st_mode & 0o777, download_images.get_file_mode())
+
+        # Credentials are not sent anywhere but to the Drive API
+        self.assertTrue(all(auth is None for _, auth in StandInDrive.requests))
+
+    def test_retry(self):
+        StandInDrive.errors = {'jan': [429, 503], 'eva': [500]}
+
+        progress = self.download()
+
+        self.assertEqual((progress.done, progress.failed), (2, 0))
+        self.assertEqual([file_id for file_id, _ in StandInDrive.requests].count('jan'), 3)
+        self.assertEqual([file_id for file_id, _ in StandInDrive.requests].count('eva'), 2)
+        self.assertTrue(os.path.exists(os.path.join('pictures', 'Jan Novak.jpg')))
+
+    def test_retries_exhausted(self):
+        StandInDrive.errors = {'jan': [503] * 10}
+
+        progress = self.download('--retries', '1')
+
+        self.assertEqual((progress.done, progress.failed), (2, 1))
+        self.assertEqual([file_id for file_id, _ in StandInDrive.requests].count('jan'), 2)
+        self.assertFalse(os.path.exists(os.path.join('pictures', 'Jan Novak.jpg')))
+
+    def test_not_found(self):
+        del StandInDrive.files['eva']
+
+        progress = self.download()
+
+        self.assertEqual((progress.done, progress.failed), (2, 1))
+        # Not retried
+        self.assertEqual([file_id for file_id, _ in StandInDrive.requests].count('eva'), 1)
+
+    def test_incremental_unusable_photo(self):
+        StandInDrive.files['eva'] = b'not an image at all'
+
+        progress = self.download('--incremental')
+        self.assertEqual((progress.done, progress.unknown), (2, 1))
+        self.assertTrue(os.path.exists(os.path.join('pictures', 'Eva Mala')))
+
+        # Fixed by hand by the operator, it is neither downloaded again nor overwritten
+        os.replace(os.path.join('pictures', 'Eva Mala'), os.path.join('pictures', 'Eva Mala.jpg'))
+        StandInDrive.requests = []
+        progress = self.download('--incremental')
+
+        self.assertEqual(progress.done, 0)
+        self.assertEqual(StandInDrive.requests, [])
+        self.assertFalse(os.path.exists(os.path.join('pictures', 'Eva Mala')))
+
+    def test_unconvertible_photo(self):
+        StandInDrive.files['eva'] = BROKEN_WEBP
+
+        progress = self.download('--incremental')
+
+        # Kept as downloaded for the operator, not a failed download
+        self.assertEqual((progress.done, progress.failed, progress.unknown), (2, 0, 1))
+        with open(os.path.join('pictures', 'Eva Mala.webp'), 'rb') as f:
+            self.assertEqual(f.read(), BROKEN_WEBP)
+
+        StandInDrive.requests = []
+        progress = self.download('--incremental')
+
+        self.assertEqual(progress.done, 0)
+        self.assertEqual(StandInDrive.requests, [])
+
+    def test_incremental_renamed(self):
+        self.download('--incremental')
+
+        with open('form.csv', encoding='utf-8') as f:
+            form = f.read()
+        # Jan renamed, Eva removed from the form
+        with open('form.csv', 'w', encoding='utf-8') as f:
+            f.write(form.replace('Jan Novak', 'Jan Novakova').split('\nt2,')[0] + '\n')
+        StandInDrive.requests = []
+        self.download('--incremental')
+
+        self.assertEqual(StandInDrive.requests, [])
+        self.assertEqual(os.listdir('pictures').count('Jan Novakova.jpg'), 1)
+        self.assertFalse(os.path.exists(os.path.join('pictures', 'Jan Novak.jpg')))
+        with open('students.csv', encoding='utf-8') as f:
+            self.assertEqual([line.split(',')[0] for line in f.readlines()[1:]], ['"Jan Novakova"'])
+
+    def test_incremental_replaced_photo(self):
+        StandInDrive.files['jan2'] = PNG
+        StandInDrive.errors = {'jan2': [404]}
+        self.download('--incremental')
+
+        with open('form.csv', encoding='utf-8') as f:
+            form = f.read()
+        # Jan uploaded another photo, of another type
+        with open('form.csv', 'w', encoding='utf-8') as f:
+            f.write(form.replace('open?id=jan,', 'open?id=jan2,'))
+
+        # The failed download keeps the previous photo until the next run
+        progress = self.download('--incremental', '--retries', '0')
+        self.assertEqual(progress.failed, 1)
+        self.assertTrue(os.path.exists(os.path.join('pictures', 'Jan Novak.jpg')))
+
+        progress = self.download('--incremental')
+
+        self.assertEqual((progress.done, progress.failed), (1, 0))
+        self.assertEqual(sorted(os.listdir('pictures')), ['Eva Mala.png', 'Jan Novak.png'])
+
+    def test_drive_url_authorized(self):
+        self.assertTrue(download_images.is_drive_url(download_images.DRIVE_URL))
+        self.assertFalse(download_images.is_drive_url(self.url))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import os
+import sys
+import tempfile
+import unittest
+import warnings
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import cv2 as cv
+import numpy as np
+
+import facedetector
+from config import Config, EqualizeHistMode
+from facedetector import FaceDetector
+from hist_eq_reference import hist_eq_reference
+
+
+class HistEqOtherTest(unittest.TestCase):
+    """hist_eq_other gives pixel-identical images to the original per-channel implementation"""
+
+    def assertSameAsReference(self, img):
+        with warnings.catch_warnings():
+            # The reference divides by zero for single-valued channels
+            warnings.simplefilter('ignore', RuntimeWarning)
+            expected = hist_eq_reference(img)
+        result = FaceDetector.hist_eq_other(img)
+
+        self.assertEqual(result.shape, expected.shape)
+        self.assertEqual(result.dtype, expected.dtype)
+        np.testing.assert_array_equal(result, expected)
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_random(self):
+        self.assertSameAsReference(self.rng.integers(0, 256, (120, 90, 3), dtype=np.uint8))
+
+    def test_narrow_range(self):
+        self.assertSameAsReference(self.rng.integers(10, 60, (80, 60, 3), dtype=np.uint8))
+
+    def test_gradient(self):
+        row = (np.arange(256, dtype=np.uint16) * 3 // 4).astype(np.uint8)
+        self.assertSameAsReference(np.dstack([np.tile(row, (32, 1))] * 3))
+
+    def test_single_valued_channel(self):
+        img = self.rng.integers(0, 256, (60, 80, 3), dtype=np.uint8)
+        img[:, :, 1] = 128
+        self.assertSameAsReference(img)
+
+    def test_single_valued_image(self):
+        self.assertSameAsReference(np.full((40, 30, 3), (0, 77, 255), dtype=np.uint8))
+
+
+class StubBackend:
+    """Finds one face in images which are not flat, remembers the grayscale buffers it searched in"""
+    color = False
+
+    def __init__(self):
+        self.searched = []
+
+    def detect(self, img, minsize):
+        self.searched.append((img.ctypes.data, img.shape))
+        if img.std() < 1:
+            return np.empty((0, 4), np.int32)
+        h, w = img.shape
+        return np.array([[w // 4, h // 4, w // 3, h // 3]], np.int32)
+
+
+class RunBatchTest(unittest.TestCase):
+    """run_batch yields the same results as process(), in order, reading only a bounded window ahead"""
+
+    def setUp(self):
+        self.config = Config.dump()
+        Config.interactive = False
+        Config.crop = True
+        Config.equalizehist = EqualizeHistMode.OTHER
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        model = self.path('model.xml')
+        open(model, 'w').close()
+
+        self.backend = StubBackend()
+        with mock.patch.object(facedetector, 'CascadeBackend', lambda path, scalefactor, minneighbors: self.backend):
+            self.detector = FaceDetector(model)
+
+        rng = np.random.default_rng(0)
+        self.paths = []
+        for i, (h, w, spread) in enumerate([(300, 200, 100), (300, 200, 1), (240, 320, 100), (300, 200, 100)]):
+            path = self.path(f"{i}.png")
+            cv.imwrite(path, rng.integers(20, 20 + spread, (h, w, 3), dtype=np.uint8))
+            self.paths.append(path)
+
+        broken = self.path('broken.jpg')
+        with open(broken, 'wb') as f:
+            f.write(b'not an image')
+        # Unreadable files in the middle
+        self.paths[2:2] = [self.path('missing.jpg'), broken]
+
+    def tearDown(self):
+        Config.load(self.config)
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_same_as_process(self):
+        results = list(self.detector.run_batch(self.paths, prefetch=2))
+
+        self.assertEqual([path for path, _, _ in results], self.paths)
+        for path, rects, img in results:
+            with self.subTest(path=os.path.basename(path)):
+                if path.endswith('.jpg'):
+                    self.assertEqual((rects, img), (None, None))
+                    continue
+                np.testing.assert_array_equal(img, self.detector.process(path))
+                expected = self.detector.find_face(cv.imread(path))
+                if expected is None:
+                    self.assertIsNone(rects)
+                else:
+                    np.testing.assert_array_equal(rects, expected)
+
+        self.assertIsNotNone(results[0][1])
+        # No face in the flat image, it is returned as it is
+        _, rects, img = results[1]
+        self.assertIsNone(rects)
+        np.testing.assert_array_equal(img, cv.imread(self.paths[1]))
+
+    def test_prefetch_window(self):
+        pulled = []
+
+        def paths():
+            for path in self.paths:
+                pulled.append(path)
+                yield path
+
+        batch = self.detector.run_batch(paths(), prefetch=2)
+        self.assertEqual(pulled, [])
+
+        next(batch)
+        # The current image, the one read in its place and the two read ahead
+        self.assertEqual(len(pulled), 3)
+        next(batch)
+        self.assertEqual(len(pulled), 4)
+
+        self.assertEqual(len(list(batch)), len(self.paths) - 2)
+        self.assertEqual(pulled, self.paths)
+
+    def test_buffers_reused(self):
+        list(self.detector.run_batch(self.paths))
+
+        searched = {}
+        for data, shape in self.backend.searched:
+            searched.setdefault(shape, set()).add(data)
+        # Three 300x200 images searched in one buffer, one 240x320
+        self.assertEqual({shape: len(buffers) for shape, buffers in searched.items()}, {(300, 200): 1, (240, 320): 1})
+        self.assertEqual(len(self.backend.searched), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
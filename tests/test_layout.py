@@ -0,0 +1,112 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from config import CardSpacing, FillOrder, PrintDirection, PrintMode
+from layout import LayoutEngine, Slot
+
+# mode: (columns, rows, x step, y step, x of the last column, y of the last row) on A4
+GRIDS = {
+    PrintMode.PHOTO_ONLY: (6, 7, 30, 40, 157, 247),
+    PrintMode.TEXT_ONLY: (4, 10, 49, 28, 154, 259),
+    PrintMode.ALL: (2, 7, 82, 40, 89, 247),
+}
+
+# Limits of the grid, the first card is placed there in PrintDirection.REVERSED
+RIGHT_BOTTOM = {
+    PrintMode.PHOTO_ONLY: (173, 250),
+    PrintMode.TEXT_ONLY: (154, 262),
+    PrintMode.ALL: (121, 250),
+}
+
+
+class LayoutEngineTest(unittest.TestCase):
+
+    def assertPosition(self, slot, page, x, y):
+        self.assertEqual(slot.page, page)
+        self.assertAlmostEqual(slot.x, x)
+        self.assertAlmostEqual(slot.y, y)
+
+    def test_grid(self):
+        for mode, (cols, rows, _, _, _, _) in GRIDS.items():
+            with self.subTest(mode=mode):
+                layout = LayoutEngine(mode, PrintDirection.NORMAL)
+                self.assertEqual((layout.cols, layout.rows, layout.perPage), (cols, rows, cols * rows))
+                self.assertEqual(layout.pages(0), 0)
+                self.assertEqual(layout.pages(cols * rows), 1)
+                self.assertEqual(layout.pages(cols * rows + 1), 2)
+
+    def test_rows(self):
+        for mode, (cols, rows, xStep, yStep, xLast, yLast) in GRIDS.items():
+            with self.subTest(mode=mode):
+                layout = LayoutEngine(mode, PrintDirection.NORMAL, FillOrder.ROWS)
+                self.assertPosition(layout.slot(0), 0, 7, 7)
+                self.assertPosition(layout.slot(1), 0, 7 + xStep, 7)
+                self.assertPosition(layout.slot(cols - 1), 0, xLast, 7)
+                self.assertPosition(layout.slot(cols), 0, 7, 7 + yStep)
+                self.assertPosition(layout.slot(cols * rows - 1), 0, xLast, yLast)
+
+    def test_columns(self):
+        for mode, (cols, rows, xStep, yStep, xLast, yLast) in GRIDS.items():
+            with self.subTest(mode=mode):
+                layout = LayoutEngine(mode, PrintDirection.NORMAL, FillOrder.COLUMNS)
+                self.assertPosition(layout.slot(0), 0, 7, 7)
+                self.assertPosition(layout.slot(1), 0, 7, 7 + yStep)
+                self.assertPosition(layout.slot(rows - 1), 0, 7, yLast)
+                self.assertPosition(layout.slot(rows), 0, 7 + xStep, 7)
+                self.assertPosition(layout.slot(cols * rows - 1), 0, xLast, yLast)
+
+    def test_reversed(self):
+        for mode, (cols, rows, xStep, yStep, _, _) in GRIDS.items():
+            xRight, yBottom = RIGHT_BOTTOM[mode]
+            with self.subTest(mode=mode, fill=FillOrder.ROWS):
+                layout = LayoutEngine(mode, PrintDirection.REVERSED, FillOrder.ROWS)
+                self.assertPosition(layout.slot(0), 0, xRight, yBottom)
+                self.assertPosition(layout.slot(1), 0, xRight - xStep, yBottom)
+                self.assertPosition(layout.slot(cols), 0, xRight, yBottom - yStep)
+                self.assertPosition(layout.slot(cols * rows - 1), 0,
+                                    xRight - (cols - 1) * xStep, yBottom - (rows - 1) * yStep)
+            with self.subTest(mode=mode, fill=FillOrder.COLUMNS):
+                layout = LayoutEngine(mode, PrintDirection.REVERSED, FillOrder.COLUMNS)
+                self.assertPosition(layout.slot(1), 0, xRight, yBottom - yStep)
+                self.assertPosition(layout.slot(rows), 0, xRight - xStep, yBottom)
+
+    def test_page_break(self):
+        for mode in GRIDS:
+            for direction in PrintDirection:
+                with self.subTest(mode=mode, direction=direction):
+                    layout = LayoutEngine(mode, direction)
+                    first = layout.slot(0)
+                    self.assertEqual(layout.slot(layout.perPage - 1).page, 0)
+                    self.assertEqual(layout.slot(layout.perPage), first._replace(page=1))
+                    self.assertEqual(layout.slot(2 * layout.perPage + 3), layout.slot(3)._replace(page=2))
+
+    def test_slots(self):
+        layout = LayoutEngine(PrintMode.ALL, PrintDirection.NORMAL, FillOrder.COLUMNS)
+        count = 2 * layout.perPage + 5
+
+        slots = layout.slots(count)
+
+        self.assertEqual(len(slots), count)
+        self.assertEqual(list(slots), [layout.slot(i) for i in range(count)])
+        self.assertEqual([s.page for s in slots].count(2), 5)
+        self.assertEqual(slots[-1], layout.slot(count - 1))
+        self.assertEqual(slots[1:3], [layout.slot(1), layout.slot(2)])
+        with self.assertRaises(IndexError):
+            slots[count]
+        self.assertEqual(list(layout.slots(0)), [])
+
+    def test_text_and_delimiter(self):
+        text = LayoutEngine(PrintMode.TEXT_ONLY, PrintDirection.NORMAL).slot(0)
+        self.assertEqual(text, Slot(0, 7, 7, 7, 7, 5.5, 7 - CardSpacing.rowDelta * 0.5))
+
+        card = LayoutEngine(PrintMode.ALL, PrintDirection.NORMAL).slot(0)
+        self.assertEqual((card.xText, card.yText), (7 + CardSpacing.textDelta, 7 + CardSpacing.rowDelta))
+        self.assertAlmostEqual(card.xDelim, 5.5)
+        self.assertAlmostEqual(card.yDelim, 7 - 3 * 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from people import CSVValidationError, load_people
+
+HEADER = "name,country,D0,D1,M0,M1,Y0,Y1,TD0,TD1,TM0,TM1,TY0,TY1,before_arrival\n"
+
+
+class LoadPeopleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'students.csv')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def load(self, content):
+        with open(self.path, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+        return load_people(self.path)
+
+    def assertInvalid(self, content, errors):
+        with self.assertRaises(CSVValidationError) as cm:
+            self.load(content)
+        self.assertEqual(cm.exception.path, self.path)
+        self.assertEqual([(line, message.split(' ')[0]) for line, message in cm.exception.errors], errors)
+
+    def test_valid(self):
+        people = self.load(HEADER +
+                           '"Jan Novak","Czech Republic",0,1,0,2,9,9,3,1,0,8,2,6,yes\n'
+                           '"Eva Mala","Austria",1,5,1,1,0,3,3,1,0,8,2,6,"line one\nline two"\n')
+
+        self.assertEqual([pi.name for pi in people], ['Eva Mala', 'Jan Novak'])
+        eva, jan = people
+        self.assertEqual(jan.nationality, 'Czech Republic')
+        self.assertEqual(jan.birthday, date(1999, 2, 1))
+        self.assertEqual(jan.validity, date(2026, 8, 31))
+        self.assertEqual(jan.before_arrival, 'yes')
+        self.assertEqual(eva.birthday, date(2003, 11, 15))
+        self.assertEqual(eva.before_arrival, 'line one\nline two')
+
+    def test_missing_column(self):
+        with self.assertRaises(CSVValidationError) as cm:
+            self.load(HEADER.replace('country,', '') + '"Jan Novak",0,1,0,2,9,9,3,1,0,8,2,6,yes\n')
+
+        self.assertEqual(cm.exception.errors, [(1, "missing columns: country")])
+
+    def test_bad_date(self):
+        self.assertInvalid(HEADER +
+                           '"Jan Novak","Czech Republic",0,1,0,2,9,9,3,1,0,8,2,6,yes\n'
+                           '"Eva Mala","Austria",3,1,0,2,0,3,3,1,0,8,2,6,no\n'
+                           '"Ola Nord","Norway",0,1,x,2,0,3,3,1,0,8,2,6,no\n',
+                           [(3, 'date'), (4, 'date')])
+
+    def test_line_after_multiline_value(self):
+        # Blank lines and line breaks in quoted values do not shift the reported lines
+        self.assertInvalid(HEADER +
+                           '"Jan Novak","Czech Republic",0,1,0,2,9,9,3,1,0,8,2,6,"first\nsecond\nthird"\n'
+                           '\n'
+                           '"Eva Mala","Austria",3,1,0,2,0,3,3,1,0,8,2,6,no\n'
+                           '"Ola\nNord","Norway",3,1,0,2,0,3,3,1,0,8,2,6,no\n'
+                           '"","Norway",0,1,0,2,0,3,3,1,0,8,2,6,no\n',
+                           [(6, 'date'), (7, 'date'), (9, 'name')])
+
+    def test_wrong_number_of_values(self):
+        self.assertInvalid(HEADER +
+                           '"Jan Novak","Czech Republic",0,1,0,2,9,9,3,1,0,8,2,6,yes,extra\n'
+                           '"Eva Mala","Austria",1,5\n',
+                           [(2, '1'), (3, 'values')])
+
+
+if __name__ == '__main__':
+    unittest.main()
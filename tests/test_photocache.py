@@ -0,0 +1,109 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from config import EqualizeHistMode
+from photocache import PhotoCache
+
+SETTINGS = {'crop': True, 'equalizehist': EqualizeHistMode.CLAHE, 'dpi': 300, 'jpegquality': 90}
+
+
+class PhotoCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = PhotoCache(os.path.join(self.tmpdir.name, 'cache'), 1000)
+        self.fingerprint = PhotoCache.fingerprint(SETTINGS)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def photo(self, name, data):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def put(self, name, size, mtime):
+        key = name * 32
+        self.cache.put(key, b'x' * size)
+        os.utime(self.cache.entry(key), (mtime, mtime))
+        return key
+
+    def test_fingerprint(self):
+        # Order of the settings does not matter, their values do
+        self.assertEqual(PhotoCache.fingerprint(dict(reversed(SETTINGS.items()))), self.fingerprint)
+        for name, value in (('crop', False), ('equalizehist', EqualizeHistMode.HEQ_YUV),
+                            ('dpi', 200), ('jpegquality', 95)):
+            with self.subTest(name=name):
+                self.assertNotEqual(PhotoCache.fingerprint({**SETTINGS, name: value}), self.fingerprint)
+        self.assertNotEqual(PhotoCache.fingerprint({**SETTINGS, 'detectsize': 640}), self.fingerprint)
+
+    def test_key(self):
+        jan = self.photo('Jan Novak.jpg', b'jan')
+        copy = self.photo('copy.jpg', b'jan')
+        eva = self.photo('Eva Mala.jpg', b'eva')
+
+        # Content addressed, the file name does not matter
+        self.assertEqual(self.cache.key(jan, self.fingerprint), self.cache.key(copy, self.fingerprint))
+        self.assertNotEqual(self.cache.key(jan, self.fingerprint), self.cache.key(eva, self.fingerprint))
+        self.assertNotEqual(self.cache.key(jan, self.fingerprint),
+                            self.cache.key(jan, PhotoCache.fingerprint({**SETTINGS, 'dpi': 200})))
+
+        # Changed photo gets a new key
+        key = self.cache.key(jan, self.fingerprint)
+        self.photo('Jan Novak.jpg', b'jan again')
+        self.assertNotEqual(self.cache.key(jan, self.fingerprint), key)
+
+    def test_get_put(self):
+        key = self.cache.key(self.photo('Jan Novak.jpg', b'jan'), self.fingerprint)
+        self.assertIsNone(self.cache.get(key))
+
+        self.cache.put(key, b'processed')
+
+        self.assertEqual(self.cache.get(key), b'processed')
+        self.assertEqual(os.listdir(os.path.dirname(self.cache.entry(key))), [key + '.jpg'])
+
+    def test_evict_least_recently_used(self):
+        a = self.put('a', 400, 1000)
+        b = self.put('b', 400, 2000)
+        c = self.put('c', 400, 3000)
+
+        self.cache.evict()
+
+        self.assertIsNone(self.cache.get(a))
+        self.assertIsNotNone(self.cache.get(b))
+        self.assertIsNotNone(self.cache.get(c))
+
+    def test_hit_refreshes_entry(self):
+        a = self.put('a', 400, 1000)
+        b = self.put('b', 400, 2000)
+        self.cache.get(a)
+        self.put('c', 400, 3000)
+
+        self.cache.evict()
+
+        self.assertIsNone(self.cache.get(b))
+        self.assertIsNotNone(self.cache.get(a))
+
+    def test_evict_within_limit(self):
+        keys = [self.put(name, 250, 1000 + i) for i, name in enumerate('abcd')]
+
+        self.cache.evict()
+
+        self.assertTrue(all(self.cache.get(key) is not None for key in keys))
+
+    def test_clear(self):
+        key = self.put('a', 10, 1000)
+
+        self.cache.clear()
+
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(os.listdir(self.cache.path), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
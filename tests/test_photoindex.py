@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from photoindex import PhotoIndex, normalize_name
+
+FILES = ['Jan Novak.jpg', 'Jan Novakova.png', 'Eva Mala.jpg', 'Zoë  Müller.jpeg', 'Ola Nord (2).jpg']
+
+
+class PhotoIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PhotoIndex('pictures', FILES)
+
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name('  Zoë\tMÜLLER '), 'zoe muller')
+        self.assertEqual(normalize_name('Kateřina Dvořáková'), 'katerina dvorakova')
+        self.assertEqual(normalize_name(''), '')
+
+    def test_exact(self):
+        # Exact match wins over the longer name with the same prefix
+        self.assertEqual(self.index.lookup('Jan Novak'), ['Jan Novak.jpg'])
+        self.assertEqual(self.index.lookup('jan  NOVAKOVA'), ['Jan Novakova.png'])
+        self.assertEqual(self.index.lookup('Zoe Muller'), ['Zoë  Müller.jpeg'])
+
+    def test_prefix(self):
+        self.assertEqual(self.index.lookup('Jan'), ['Jan Novak.jpg', 'Jan Novakova.png'])
+        self.assertEqual(self.index.lookup('Ola Nord'), ['Ola Nord (2).jpg'])
+
+    def test_substring(self):
+        self.assertEqual(self.index.lookup('Mala'), ['Eva Mala.jpg'])
+        self.assertEqual(self.index.lookup('Novak'), ['Jan Novak.jpg', 'Jan Novakova.png'])
+
+    def test_not_found(self):
+        self.assertEqual(self.index.lookup('Petr Svoboda'), [])
+        self.assertEqual(self.index.lookup('   '), [])
+
+    def test_duplicate_stems(self):
+        index = PhotoIndex('pictures', ['Eva Mala.png', 'Eva Mala.jpg'])
+        self.assertEqual(index.lookup('Eva Mala'), ['Eva Mala.jpg', 'Eva Mala.png'])
+
+
+class PhotoIndexCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.imgpath = os.path.join(self.tmpdir.name, 'pictures')
+        self.cachepath = os.path.join(self.tmpdir.name, 'index.json')
+        os.mkdir(self.imgpath)
+        for fn in ('Jan Novak.jpg', 'notes.txt'):
+            open(os.path.join(self.imgpath, fn), 'wb').close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_build(self):
+        index = PhotoIndex.build(self.imgpath, ('.jpg', '.png'), self.cachepath)
+
+        self.assertEqual(index.files, ['Jan Novak.jpg'])
+        self.assertTrue(os.path.exists(self.cachepath))
+
+    def test_cache_reused_until_directory_changes(self):
+        PhotoIndex.build(self.imgpath, ('.jpg', '.png'), self.cachepath)
+        mtime = os.stat(self.imgpath).st_mtime_ns
+        self.assertEqual(PhotoIndex.load(self.cachepath, self.imgpath, mtime).files, ['Jan Novak.jpg'])
+
+        open(os.path.join(self.imgpath, 'Eva Mala.png'), 'wb').close()
+        # Force a different mtime, file systems with a coarse resolution would not change it
+        os.utime(self.imgpath, ns=(mtime + 10**9, mtime + 10**9))
+
+        self.assertIsNone(PhotoIndex.load(self.cachepath, self.imgpath, mtime + 10**9))
+        index = PhotoIndex.build(self.imgpath, ('.jpg', '.png'), self.cachepath)
+        self.assertEqual(index.files, ['Eva Mala.png', 'Jan Novak.jpg'])
+
+    def test_broken_cache(self):
+        with open(self.cachepath, 'w', encoding='utf-8') as f:
+            f.write('{not json')
+
+        index = PhotoIndex.build(self.imgpath, ('.jpg',), self.cachepath)
+
+        self.assertEqual(index.files, ['Jan Novak.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()